@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# activedns-pipeline.py: Runs the ActiveDNS workflow (process-activedns.py, activedns-rank-json.py,
+#   domain-record-format.py and classify.py) as one chain of generators, so the records are
+#   never written out and re-parsed between stages. The intermediate files can still be
+#   written for debugging.
+#   INPUT: Directory of ActiveDNS *.avro files and the Cisco top-1m.csv ranking
+#   OUTPUT: <name>-class.json (or <name>-class/ shards with --stream) and, with --mx, <name>-mx.txt
+
+import sys
+import glob
+import os
+import re
+import json
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+from activedns import *
+from classify import *
+
+# Set in main() before the worker pool forks so every worker shares the one copy
+TOPDOMAINS = {}
+
+
+# Worker: reads one avro file, keeps the requested record types and joins them against the
+# top domains. The (rank, line) pairs are written in input order to a temporary file in the
+# spillRun format rather than returned, so files waiting on the consumer don't hold their
+# records in memory. Returns the number of ranked records.
+def rankAvroFile(job):
+    (infile, qtypes, json_file, ranked_file) = job
+    output = open(json_file, 'w') if json_file else None
+    count = 0
+
+    try:
+        with open(ranked_file, 'w') as f:
+            for (rank, line) in rankRecords(TOPDOMAINS, teeJson(readAvroFile(infile, qtypes), output)):
+                f.write("{}\t{}\n".format(rank, line))
+                count += 1
+    finally:
+        if output is not None:
+            output.close()
+
+    return count
+
+
+# Yields every ranked record of every file, in file order. Each file's records go through a
+# temporary file in tmpdir that is removed once it has been read.
+def rankFiles(jobs, processes, tmpdir):
+    jobs = [job + (os.path.join(tmpdir, 'ranked-{:06d}'.format(i)),) for (i, job) in enumerate(jobs)]
+    if (processes > 1):
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(rankAvroFile, jobs)
+    else:
+        pool = None
+        results = (rankAvroFile(job) for job in jobs)
+
+    try:
+        for (i, count) in enumerate(results):
+            (infile, qtypes, json_file, ranked_file) = jobs[i]
+            sys.stdout.write("Processed {}: {} ranked records\n".format(infile, count))
+            for (rank, run_index, position, line) in readRun(ranked_file, i):
+                yield (rank, line)
+            os.remove(ranked_file)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+# Decodes the sorted JSON lines, writing them to f first if given
+def teeLines(lines, f=None):
+    for line in lines:
+        if f is not None:
+            f.write("{}\n".format(line))
+        yield json.loads(line)
+
+
+def main():
+    global TOPDOMAINS
+    total_records = 0
+
+    parser = argparse.ArgumentParser(description="Classifies the top ranked TXT records of an ActiveDNS avro dump in a single pass")
+    parser.add_argument('indir', type=str)
+    parser.add_argument('name', type=str, help="Base name for the outputs, e.g. activedns-20180101")
+    parser.add_argument('--topfile', type=str, default=os.path.join(os.getcwd(), 'top-1m.csv'))
+    parser.add_argument('--rank-index', type=str, help="Prebuilt rank index for --topfile, built here if missing or stale")
+    parser.add_argument('--unique-rrsets', type=int, default=UNIQUE_RRSETS, help="Number of top ranked TXT rrsets to keep")
+    parser.add_argument('--mx', action='store_true', help="Also keep MX records and write <name>-mx.txt")
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(), help="Number of avro decoding processes")
+    parser.add_argument('--run-size', type=int, default=RUN_SIZE, help="Records sorted in memory before spilling a run to disk")
+    parser.add_argument('--tmpdir', type=str, default=None, help="Directory for the temporary sorted runs")
+    parser.add_argument('--stream', action='store_true', help="Write per-class shards instead of one JSON file")
+    parser.add_argument('--rules', type=str, default=RULES_FILE, help="Classifier rules file")
+    parser.add_argument('--cache-size', type=int, default=CLASSIFICATION_CACHE_SIZE, help="Number of distinct rrdata classifications to remember (0 to disable)")
+    parser.add_argument('--cache-file', type=str, help="Load the classification cache from and save it back to this file")
+    parser.add_argument('--snapshot', action='store_true', help="Also write a columnar <name>-class.snapshot directory with ranks")
+    parser.add_argument('--json-dir', type=str, help="Debug: also write the per-file JSON that process-activedns.py would")
+    parser.add_argument('--ranked-file', type=str, help="Debug: also write the ranked JSON that activedns-rank-json.py would")
+    parser.add_argument('--txt-file', type=str, help="Debug: also write the TXT record list that domain-record-format.py would")
+    args = parser.parse_args()
+
+    qtypes = set([QTYPE_TXT])
+    if args.mx:
+        qtypes.add(QTYPE_MX)
+
+    if args.json_dir and not os.path.isdir(args.json_dir):
+        os.makedirs(args.json_dir)
+
+    jobs = []
+    for infile in sorted(glob.glob(os.path.join(args.indir, "*.avro"))):
+        json_file = None
+        if args.json_dir:
+            filenum = re.search('(\d+)\.avro', infile).group(1)
+            json_file = os.path.join(args.json_dir, '{}.json'.format(filenum))
+        jobs.append((infile, qtypes, json_file))
+
+    TOPDOMAINS = loadTopdomains(args.topfile, args.rank_index)
+    setupClassifier(args.rules, args.cache_size, args.cache_file)
+
+    writer = ShardWriter('{}-class'.format(args.name)) if args.stream else None
+    snapshot = SnapshotWriter('{}-class.snapshot'.format(args.name)) if args.snapshot else None
+    mx_f = open('{}-mx.txt'.format(args.name), 'w') if args.mx else None
+    ranked_f = open(args.ranked_file, 'w') if args.ranked_file else None
+    txt_f = open(args.txt_file, 'w') if args.txt_file else None
+    tmpdir = tempfile.mkdtemp(prefix='activedns-pipeline-', dir=args.tmpdir)
+
+    try:
+        lines = sortRecords(rankFiles(jobs, args.jobs, tmpdir), args.run_size, tmpdir)
+
+        for record in selectTopRrsets(teeLines(lines, ranked_f), args.unique_rrsets):
+            line = '{} {}'.format(record['qname'], record['rdata'])
+
+            if record['qtype'] == QTYPE_MX:
+                mx_f.write('{}\n'.format(line))
+                continue
+
+            if txt_f is not None:
+                txt_f.write('{}\n'.format(line))
+
+            parsed = parseLine(line)
+            if not parsed:
+                continue
+
+            (identifier, classified) = classifyRecord(parsed)
+            if writer is not None:
+                writer.write(identifier, classified)
+            else:
+                addRecord(identifier, classified)
+
+            if snapshot is not None:
+                snapshot.write(identifier, classified.domain, classified.rdata, record['rank'])
+            total_records += 1
+
+        # The selection stops reading once its quota is filled; the debug ranked file still
+        # gets every record
+        if ranked_f is not None:
+            for line in lines:
+                ranked_f.write("{}\n".format(line))
+
+    finally:
+        shutil.rmtree(tmpdir)
+        for f in (mx_f, ranked_f, txt_f):
+            if f is not None:
+                f.close()
+
+    if snapshot is not None:
+        snapshot.close()
+
+    if writer is not None:
+        finishShards(writer)
+    else:
+        writeRecordTypes('{}-class.json'.format(args.name))
+
+    sys.stdout.write("{} Records Classified\n".format(total_records))
+    finishCache(args.cache_file)
+
+
+if __name__ == '__main__': main()
@@ -9,70 +9,64 @@ import glob
 import os
 import re
 import json
+import shutil
+import tempfile
 import argparse
-import fastavro as avro
 
+from activedns import *
 
-def buildTopdomains(topfile):
-    topdomains = {}
-    sys.stdout.write("Reading top 1 million domains into memory\n")
-    with open(topfile, 'r') as f:
-        for line in f.readlines():
-            line = line.strip()
-            parts = line.split(',')
-            rank = parts[0]
-            domain = parts[1]
 
-            if not(domain.endswith('.')):
-                domain += '.'
+# Lines whose qname isn't in the top domains are skipped before they are decoded
+def processJsonFile(topdomains, infile, loads=json.loads):
+    sys.stdout.write("Processing {}\n".format(infile))
+    keep = rawFieldFilter('qname', topdomains.__contains__)
+    return rankRecords(topdomains, readJsonFile(infile, keep, loads))
 
-            topdomains[domain] = rank
-
-    return topdomains
 
+def readRecords(topdomains, filelist, loads=json.loads):
+    for infile in filelist:
+        for record in processJsonFile(topdomains, infile, loads):
+            yield record
 
-def processJsonFile(topdomains, infile):
-    with open(infile, 'r') as f:
-        sys.stdout.write("Processing {}\n".format(infile))
-        for line in f.readlines():
-            line = line.strip()
-            record = json.loads(line)
-            qname = record['qname']
 
-            try:
-                rank = topdomains[qname]
-                record['rank'] = rank
-                yield(record)
-            except KeyError:
-                pass
+# Lists the per-file JSON outputs of process-activedns.py. A file that is there both plain and
+# block-compressed is only listed once, as the plain file, so its records aren't ranked twice.
+def listJsonFiles(indir):
+    filelist = glob.glob(indir + "/*.json")
+    for infile in glob.glob(indir + "/*.json" + BLOCK_SUFFIX):
+        if not os.path.isfile(infile[:-len(BLOCK_SUFFIX)]):
+            filelist.append(infile)
+    return sorted(filelist)
 
 
 def main():
 
     parser = argparse.ArgumentParser(description="Processes a directory of JSON formatted ActiveDNS records into a single ranked file")
     parser.add_argument('indir', type=str)
+    parser.add_argument('--run-size', type=int, default=RUN_SIZE, help="Records sorted in memory before spilling a run to disk")
+    parser.add_argument('--tmpdir', type=str, default=None, help="Directory for the temporary sorted runs")
+    parser.add_argument('--topfile', type=str, default=os.path.join(os.getcwd(), 'top-1m.csv'))
+    parser.add_argument('--rank-index', type=str, help="Prebuilt rank index for --topfile, built here if missing or stale")
+    parser.add_argument('--json-backend', type=str, choices=JSON_BACKENDS, default='json', help="Module used to decode the JSON records")
+    parser.add_argument('--compress', type=str, choices=COMPRESS_CODECS, help="Write a block-compressed output.json.blk indexed by rank")
     args = parser.parse_args()
 
     basedir = os.getcwd()
-    topfile = basedir + '/top-1m.csv'
-    filelist = glob.glob(args.indir + "/*.json")
+    filelist = listJsonFiles(args.indir)
     outfile = basedir + '/output.json'
 
-    topdomains = buildTopdomains(topfile)
-
-    records = []
-    filelist.sort()
-
-    for infile in filelist:
-        for record in processJsonFile(topdomains, infile):
-            records.append(record)
+    loads = jsonDecoder(args.json_backend)
+    topdomains = loadTopdomains(args.topfile, args.rank_index)
 
-    sys.stdout.write("Sorting {} Records...\n".format(len(records)))
-    sorted_records = sorted(records, key=lambda k: int(k['rank']))
+    tmpdir = tempfile.mkdtemp(prefix='activedns-rank-', dir=args.tmpdir)
 
-    with open(outfile, 'w') as o:
-        for record in sorted_records:
-            o.write("{}\n".format(json.dumps(record)))
+    try:
+        (o, outfile) = openJsonOutput(outfile, args.compress)
+        with o:
+            for (rank, record) in sortRecords(readRecords(topdomains, filelist, loads), args.run_size, tmpdir, ranks=True):
+                writeJsonLine(o, record, rank)
+    finally:
+        shutil.rmtree(tmpdir)
 
 
 if __name__ == '__main__': main()
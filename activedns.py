@@ -0,0 +1,384 @@
+# activedns.py: Library functions for the ActiveDNS processing stages. Each stage is a
+#   generator so the stages can be chained in one process (activedns-pipeline.py) or run
+#   one at a time by the individual scripts with their intermediate files in between.
+
+import os
+import sys
+import json
+import array
+import heapq
+import bisect
+import struct
+import importlib
+import fastavro as avro
+
+from dns_audit import domainHash, hashArray
+from blockfile import BlockWriter, BlockReader, isBlockFile, BLOCK_SUFFIX, CODECS
+
+QTYPE_TXT = 16
+QTYPE_MX = 15
+
+RUN_SIZE = 1000000
+UNIQUE_RRSETS = 10000
+
+# Modules with a json-compatible loads() that can decode the line-delimited JSON files
+JSON_BACKENDS = ('json', 'simplejson', 'ujson')
+
+# --compress choices for the JSON intermediates; auto picks the fastest installed codec
+COMPRESS_CODECS = ('auto',) + CODECS
+
+# Rank index file: magic, entry count and the size and mtime of the CSV it was built from,
+# then the offset of the first hash in each of the 2^RANK_INDEX_BUCKET_BITS hash prefix
+# buckets plus the end (uint32), the sorted 63-bit domain hashes (int64) and then the rank
+# of each hash (uint32), all little-endian
+RANK_INDEX_MAGIC = b'RANKIDX2'
+RANK_INDEX_HEADER = struct.Struct('<8sQQd')
+RANK_INDEX_BUCKET_BITS = 16
+RANK_INDEX_BUCKET_SHIFT = 63 - RANK_INDEX_BUCKET_BITS
+RANK_TYPECODE = 'I' if array.array('I').itemsize == 4 else 'L'
+
+
+# Reads an ActiveDNS avro file and yields the records whose qtype is in qtypes. If a counts
+# dict is given, counts['total'] is incremented for every record read.
+def readAvroFile(infile, qtypes, counts=None):
+    with open(infile, 'rb') as i:
+        reader = avro.reader(i)
+        for record in reader:
+            if counts is not None:
+                counts['total'] += 1
+            if (record['qtype'] in qtypes):
+                yield record
+
+
+# Returns the loads() function of one of JSON_BACKENDS. The optional backends are faster
+# but have to be installed; an ImportError is raised if they aren't.
+def jsonDecoder(backend='json'):
+    if backend not in JSON_BACKENDS:
+        raise ValueError("Unknown JSON backend {}".format(backend))
+    return importlib.import_module(backend).loads
+
+
+# Given a field name and a predicate, returns a filter that checks the field's raw text in
+# a line written by json.dumps, before the line is decoded. String values are passed to the
+# predicate without their quotes and numbers as written. Lines the field can't be read from
+# this way (other separators, escaped strings) are always kept, so the filter only skips
+# lines that would have been rejected after decoding anyway.
+def rawFieldFilter(field, accept):
+    key = '"{}": '.format(field)
+
+    def keep(line):
+        start = line.find(key)
+        if start < 0:
+            return True
+        start += len(key)
+
+        if line.startswith('"', start):
+            end = line.find('"', start + 1)
+            value = line[start + 1:end]
+            if (end < 0 or '\\' in value):
+                return True
+        else:
+            end = start
+            while (end < len(line) and line[end] not in ',}'):
+                end += 1
+            value = line[start:end]
+
+        return accept(value)
+
+    return keep
+
+
+# Reads a line-delimited JSON file of ActiveDNS records, plain or block-compressed. Lines
+# rejected by keep (see rawFieldFilter) are skipped without being decoded; loads picks the
+# JSON backend.
+def readJsonFile(infile, keep=None, loads=json.loads):
+    if isBlockFile(infile):
+        with BlockReader(infile) as reader:
+            for record in decodeLines(reader.lines(), keep, loads):
+                yield record
+    else:
+        with open(infile, 'r') as f:
+            for record in decodeLines(f, keep, loads):
+                yield record
+
+
+def decodeLines(lines, keep=None, loads=json.loads):
+    for line in lines:
+        if (keep is None or keep(line)):
+            yield loads(line.strip())
+
+
+# Reads the records ranked low to high (inclusive) from a ranked JSON file written by
+# activedns-rank-json.py. Only the blocks of a block-compressed file that cover the range
+# are decompressed; a plain file is read from the start up to the end of the range.
+def readRankRange(infile, low, high, keep=None, loads=json.loads):
+    if isBlockFile(infile):
+        reader = BlockReader(infile)
+        lines = reader.lines(*reader.findBlocks(low, high))
+    else:
+        reader = open(infile, 'r')
+        lines = reader
+
+    try:
+        for record in decodeLines(lines, keep, loads):
+            rank = int(record['rank'])
+            if rank > high:
+                return
+            if rank >= low:
+                yield record
+    finally:
+        reader.close()
+
+
+# Opens an output for JSON lines: a plain file, or a BlockWriter appending BLOCK_SUFFIX to
+# the name if a codec is given. Returns (output, path); lines go through writeJsonLine.
+def openJsonOutput(path, codec=None):
+    if codec is None:
+        return (open(path, 'w'), path)
+    path += BLOCK_SUFFIX
+    return (BlockWriter(path, codec), path)
+
+
+# Writes one JSON line to a file from openJsonOutput, with its rank as the block key
+def writeJsonLine(output, line, rank=None):
+    if isinstance(output, BlockWriter):
+        output.write(line, rank)
+    else:
+        output.write("{}\n".format(line))
+
+
+# Passes records through unchanged, writing each one to f as a JSON line if f is given
+def teeJson(records, f=None):
+    for record in records:
+        if f is not None:
+            f.write("{}\n".format(json.dumps(record)))
+        yield record
+
+
+def buildTopdomains(topfile):
+    topdomains = {}
+    sys.stdout.write("Reading top 1 million domains into memory\n")
+    with open(topfile, 'r') as f:
+        for line in f:
+            line = line.strip()
+            parts = line.split(',')
+            rank = parts[0]
+            domain = parts[1]
+
+            if not(domain.endswith('.')):
+                domain += '.'
+
+            topdomains[domain] = rank
+
+    return topdomains
+
+
+# Given the top domains CSV, returns [(hash, rank)] sorted by hash. If a domain is listed
+# twice the later rank wins, as it does in buildTopdomains.
+def readRankEntries(topfile):
+    ranks = {}
+    with open(topfile, 'r') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 2:
+                continue
+
+            domain = parts[1]
+            if not(domain.endswith('.')):
+                domain += '.'
+
+            ranks[domainHash(domain)] = int(parts[0])
+
+    return sorted(ranks.items())
+
+
+# Writes the rank index for a top domains CSV
+def buildRankIndex(topfile, indexfile):
+    source = os.stat(topfile)
+    entries = readRankEntries(topfile)
+    hashes = hashArray(h for (h, rank) in entries)
+    ranks = array.array(RANK_TYPECODE, (rank for (h, rank) in entries))
+
+    buckets = array.array(RANK_TYPECODE, [0] * ((1 << RANK_INDEX_BUCKET_BITS) + 1))
+    for h in hashes:
+        buckets[(h >> RANK_INDEX_BUCKET_SHIFT) + 1] += 1
+    for i in range(1, len(buckets)):
+        buckets[i] += buckets[i - 1]
+
+    if sys.byteorder != 'little':
+        buckets.byteswap()
+        hashes.byteswap()
+        ranks.byteswap()
+
+    tmpfile = '{}.tmp'.format(indexfile)
+    with open(tmpfile, 'wb') as f:
+        f.write(RANK_INDEX_HEADER.pack(RANK_INDEX_MAGIC, len(entries), source.st_size, source.st_mtime))
+        buckets.tofile(f)
+        hashes.tofile(f)
+        ranks.tofile(f)
+    os.rename(tmpfile, indexfile)
+
+
+# Top domains ranks looked up by domain hash: a sorted array of hashes and a parallel array
+# of ranks, read straight from a prebuilt index file (about 12 bytes per domain, versus a
+# dict of strings). The hash prefix buckets narrow each bisect to a handful of entries.
+# index[qname] returns the integer rank or raises KeyError, like the buildTopdomains dict.
+# The arrays hold no Python objects, so worker processes forked after loading share the pages.
+class RankIndex(object):
+
+    def __init__(self, indexfile):
+        with open(indexfile, 'rb') as f:
+            (magic, count, size, mtime) = RANK_INDEX_HEADER.unpack(f.read(RANK_INDEX_HEADER.size))
+            if magic != RANK_INDEX_MAGIC:
+                raise ValueError("{} is not a rank index".format(indexfile))
+
+            self.buckets = array.array(RANK_TYPECODE)
+            self.buckets.fromfile(f, (1 << RANK_INDEX_BUCKET_BITS) + 1)
+            self.hashes = hashArray()
+            self.hashes.fromfile(f, count)
+            self.ranks = array.array(RANK_TYPECODE)
+            self.ranks.fromfile(f, count)
+
+        if sys.byteorder != 'little':
+            self.buckets.byteswap()
+            self.hashes.byteswap()
+            self.ranks.byteswap()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, domain):
+        try:
+            self[domain]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, domain):
+        value = domainHash(domain)
+        bucket = value >> RANK_INDEX_BUCKET_SHIFT
+        end = self.buckets[bucket + 1]
+        position = bisect.bisect_left(self.hashes, value, self.buckets[bucket], end)
+        if (position < end and self.hashes[position] == value):
+            return self.ranks[position]
+        raise KeyError(domain)
+
+
+# Given a rank index file, returns the (size, mtime) of the CSV it was built from, or None if
+# it is missing, truncated or not a current rank index
+def rankIndexSource(indexfile):
+    if not os.path.isfile(indexfile):
+        return None
+
+    with open(indexfile, 'rb') as f:
+        header = f.read(RANK_INDEX_HEADER.size)
+    if len(header) < RANK_INDEX_HEADER.size:
+        return None
+
+    (magic, count, size, mtime) = RANK_INDEX_HEADER.unpack(header)
+    if magic != RANK_INDEX_MAGIC:
+        return None
+    return (size, mtime)
+
+
+# Loads the top domains ranks. With an index file, the index is rebuilt only when it is
+# missing or was built from a CSV with a different size or mtime, so daily runs against the
+# same list skip parsing it but a replaced list is always picked up.
+def loadTopdomains(topfile, indexfile=None):
+    if indexfile is None:
+        return buildTopdomains(topfile)
+
+    source = os.stat(topfile)
+    if rankIndexSource(indexfile) != (source.st_size, source.st_mtime):
+        sys.stdout.write("Building rank index {}\n".format(indexfile))
+        buildRankIndex(topfile, indexfile)
+
+    return RankIndex(indexfile)
+
+
+# Joins records against the top domains list (a buildTopdomains dict or a RankIndex),
+# dropping any record not in it. Yields (rank, line) where line is the JSON form of the
+# record with its rank added as a string.
+def rankRecords(topdomains, records):
+    for record in records:
+        try:
+            rank = topdomains[record['qname']]
+        except KeyError:
+            continue
+        record['rank'] = str(rank)
+        yield (int(rank), json.dumps(record))
+
+
+# Sorts a list of (rank, line) by rank and writes it to a temporary run file as "rank\tline".
+# sort() is stable, so records with the same rank keep their input order.
+def spillRun(run, tmpdir, run_index):
+    run.sort(key=lambda k: k[0])
+    path = os.path.join(tmpdir, 'run-{:06d}'.format(run_index))
+    with open(path, 'w') as f:
+        for (rank, line) in run:
+            f.write("{}\t{}\n".format(rank, line))
+    return path
+
+
+# Reads a run file back as (rank, run_index, position, line). The run index and position
+# break ties between equal ranks so the merge keeps the original input order.
+def readRun(path, run_index):
+    with open(path, 'r') as f:
+        for (position, line) in enumerate(f):
+            (rank, record) = line.rstrip('\n').split('\t', 1)
+            yield (int(rank), run_index, position, record)
+
+
+# External merge sort: ranked records are collected into runs of at most run_size records,
+# each run is sorted and spilled to disk, and the runs are then merged by rank with a heap.
+# The output matches a single stable in-memory sort of every record. If everything fits in
+# one run nothing is written to disk. Yields the lines, or (rank, line) if ranks is set.
+def sortRecords(records, run_size, tmpdir, ranks=False):
+    runs = []
+    run = []
+    total = 0
+
+    for record in records:
+        run.append(record)
+        total += 1
+        if (len(run) >= run_size):
+            runs.append(spillRun(run, tmpdir, len(runs)))
+            run = []
+
+    if not runs:
+        sys.stdout.write("Sorting {} Records...\n".format(total))
+        run.sort(key=lambda k: k[0])
+        for (rank, record) in run:
+            yield (rank, record) if ranks else record
+        return
+
+    if run:
+        runs.append(spillRun(run, tmpdir, len(runs)))
+        run = []
+
+    sys.stdout.write("Merging {} Records from {} sorted runs...\n".format(total, len(runs)))
+    for (rank, run_index, position, record) in heapq.merge(*[readRun(path, i) for (i, path) in enumerate(runs)]):
+        yield (rank, record) if ranks else record
+
+
+# Given ranked records in rank order, yields the records of the first unique_rrsets rrsets
+# of the qtypes given (TXT by default) and any records of the passthrough qtypes (MX) seen
+# before the quota fills, the selection made by domain-record-format.py. Stops reading
+# records as soon as the quota is filled.
+def selectTopRrsets(records, unique_rrsets=UNIQUE_RRSETS, qtypes=(QTYPE_TXT,), passthrough=(QTYPE_MX,)):
+    rrsets = set()
+
+    if unique_rrsets <= 0:
+        return
+
+    for record in records:
+        qtype = record['qtype']
+
+        if qtype in qtypes:
+            rrsets.add((record['qname'], qtype))
+            yield record
+            if (len(rrsets) >= unique_rrsets):
+                return
+
+        elif qtype in passthrough:
+            yield record
@@ -0,0 +1,153 @@
+# address_space.py: IPv4/IPv6 address-space accounting for the SPF analysis. Networks are
+#   parsed straight into integer [start, end] intervals, kept in flat arrays (lists of longs
+#   for IPv6, which is wider than any array type) and merged with a sort-and-sweep, so
+#   overlapping and repeated networks are only counted once.
+
+import array
+import socket
+import struct
+
+IP4_TYPECODE = 'L'
+
+# Intervals held by an AddressSpace before update() merges them down
+MERGE_THRESHOLD = 1000000
+
+
+# Given a dotted-quad IPv4 address, returns it as an integer. Like netaddr, an address with
+# fewer than four parts is padded with zeros on the right ("10.1" is 10.1.0.0).
+def parseIp4(address):
+    parts = address.split('.')
+    if not (1 <= len(parts) <= 4):
+        raise ValueError("Bad IPv4 address {}".format(address))
+
+    value = 0
+    for part in parts:
+        octet = int(part)
+        if not (0 <= octet <= 255):
+            raise ValueError("Bad IPv4 address {}".format(address))
+        value = (value << 8) | octet
+    return value << (8 * (4 - len(parts)))
+
+
+# Given an IPv4 netmask ("255.255.255.0") or hostmask ("0.0.0.255"), returns its prefix
+# length; netmasks win where both readings fit, as in netaddr
+def parseIp4Mask(mask):
+    value = parseIp4(mask)
+    for prefix in range(33):
+        host = (1 << (32 - prefix)) - 1
+        if value == 0xffffffff ^ host:
+            return prefix
+    for prefix in range(33):
+        if value == (1 << (32 - prefix)) - 1:
+            return prefix
+    raise ValueError("Bad IPv4 mask {}".format(mask))
+
+
+# Given an IPv6 address, returns it as an integer
+def parseIp6(address):
+    try:
+        (high, low) = struct.unpack('>QQ', socket.inet_pton(socket.AF_INET6, address))
+    except socket.error:
+        raise ValueError("Bad IPv6 address {}".format(address))
+    return (high << 64) | low
+
+
+# Given a network in CIDR form ("192.0.2.0/24", "2001:db8::/32" or a bare address), returns
+# (family, start, end) with the host bits of start cleared. IPv4 networks may also give a
+# netmask or hostmask ("192.0.2.0/255.255.255.0"). Raises ValueError if it is invalid.
+def parseNetwork(network):
+    (address, separator, prefix) = network.partition('/')
+
+    if ':' in address:
+        (family, bits, value) = (6, 128, parseIp6(address))
+    else:
+        (family, bits, value) = (4, 32, parseIp4(address))
+
+    if not separator:
+        prefix = bits
+    elif (family == 4 and '.' in prefix):
+        prefix = parseIp4Mask(prefix)
+    else:
+        prefix = int(prefix)
+    if not (0 <= prefix <= bits):
+        raise ValueError("Bad prefix length in {}".format(network))
+
+    host = (1 << (bits - prefix)) - 1
+    start = value & ~host
+    return (family, start, start | host)
+
+
+# Given lists of interval starts and ends, returns them sorted with overlapping and adjacent
+# intervals merged
+def mergeIntervals(starts, ends):
+    merged_starts = []
+    merged_ends = []
+
+    for i in sorted(range(len(starts)), key=starts.__getitem__):
+        (start, end) = (starts[i], ends[i])
+        if merged_ends and start <= merged_ends[-1] + 1:
+            if end > merged_ends[-1]:
+                merged_ends[-1] = end
+        else:
+            merged_starts.append(start)
+            merged_ends.append(end)
+
+    return (merged_starts, merged_ends)
+
+
+# A set of IPv4 and IPv6 addresses held as intervals. Networks can be added in any order;
+# size() merges the intervals first so every address is only counted once.
+class AddressSpace(object):
+
+    def __init__(self):
+        self.starts = {4: array.array(IP4_TYPECODE), 6: []}
+        self.ends = {4: array.array(IP4_TYPECODE), 6: []}
+        self.merged = True
+        self.threshold = MERGE_THRESHOLD
+
+    # Adds a network given in CIDR form; raises ValueError if it can't be parsed or isn't of
+    # the given family
+    def add(self, network, family=None):
+        (parsed, start, end) = parseNetwork(network)
+        if (family is not None and parsed != family):
+            raise ValueError("{} is not an IPv{} network".format(network, family))
+        family = parsed
+
+        self.starts[family].append(start)
+        self.ends[family].append(end)
+        self.merged = False
+
+    def merge(self):
+        if not self.merged:
+            for family in (4, 6):
+                (starts, ends) = mergeIntervals(self.starts[family], self.ends[family])
+                if family == 4:
+                    (starts, ends) = (array.array(IP4_TYPECODE, starts), array.array(IP4_TYPECODE, ends))
+                (self.starts[family], self.ends[family]) = (starts, ends)
+            self.merged = True
+        return self
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
+
+    # Adds every interval of another AddressSpace. Intervals are merged whenever the count
+    # doubles past MERGE_THRESHOLD, so memory follows the distinct ranges, not the input.
+    def update(self, other):
+        for family in (4, 6):
+            self.starts[family].extend(other.starts[family])
+            self.ends[family].extend(other.ends[family])
+        self.merged = False
+
+        if (len(self) > self.threshold):
+            self.merge()
+            self.threshold = max(MERGE_THRESHOLD, len(self) * 2)
+
+    # Returns the number of distinct addresses of a family (4 or 6)
+    def size(self, family):
+        self.merge()
+        starts = self.starts[family]
+        ends = self.ends[family]
+        return sum(ends[i] - starts[i] + 1 for i in range(len(starts)))
+
+    def networks(self, family):
+        return len(self.starts[family])
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# benchmark.py: Timing harness for the offline processing steps. Each sub-command checks that
+#   the optimized code path gives the same answers as a straightforward reference version
+#   before reporting throughput for both.
+
+import os
+import imp
+import sys
+import time
+import random
+import argparse
+
+from dns_audit import *
+from spf_expand import *
+from address_space import *
+from snapshot import *
+
+import activedns
+import classify_reference
+
+CORPUS_ALPHABET = 'abcdefABCDEF0123456789=:|.-"/ #xyzVSPF'
+
+
+# Builds n TXT rdata strings that exercise the classifier rules: rule patterns cut short,
+# randomly upper-cased and followed by noise, plus digit|token records, hex and plain noise
+def syntheticTxtCorpus(n, seed):
+    rand = random.Random(seed)
+    patterns = [pattern for rule in RULE_REGISTRY.rules if rule['match'] != 'regex' for pattern in rule['patterns']]
+    corpus = []
+
+    for i in range(n):
+        r = rand.random()
+        tail = ''.join(rand.choice(CORPUS_ALPHABET) for j in range(rand.randint(0, 12)))
+        if r < 0.5:
+            pattern = ''.join(c.upper() if rand.random() < 0.3 else c for c in rand.choice(patterns))
+            corpus.append('"{}{}"'.format(pattern[:rand.randint(1, len(pattern))], tail))
+        elif r < 0.6:
+            corpus.append('{}{}'.format(tail, rand.choice(patterns)))
+        elif r < 0.7:
+            corpus.append('{}|{}'.format(rand.randint(0, 9), ''.join(rand.choice('09a.-b') for j in range(5))))
+        elif r < 0.8:
+            corpus.append(''.join(rand.choice('0123456789abcdef') for j in range(rand.randint(1, 16))))
+        else:
+            corpus.append(tail)
+
+    return corpus
+
+
+def writeCorpus(args):
+    with open(args.output, 'w') as f:
+        for (i, record) in enumerate(syntheticTxtCorpus(args.records, args.seed)):
+            f.write('example{}.com. {}\n'.format(i, record))
+
+
+def splitRecord(record):
+    rparts = record.split()
+    return (rparts[0], ' '.join(rparts[1:]))
+
+
+# Reference diff: the original list-scanning diffSet from diff-results.py over "domain rdata"
+# strings, counting rrset records by exact name
+def diffSetLinear(diff_results, set1, set2):
+    diff_set = { 'changed' : {}, 'missing' : {}, 'new': {} }
+
+    def addDiff(change, key, record):
+        diff_set[change].setdefault(key, {'records': [], 'count': 0})
+        diff_set[change][key]['records'].append(record)
+        diff_set[change][key]['count'] += 1
+
+    def countOccurances(rrset, records):
+        return len([record for record in records if splitRecord(record)[0] == rrset])
+
+    for key in set1.keys():
+        for record in set1[key]['records']:
+            if key not in set2:
+                addDiff('missing', key, record)
+            elif (record not in set2[key]['records']):
+                rrset = splitRecord(record)[0]
+                set1count = countOccurances(rrset, set1[key]['records'])
+                set2count = countOccurances(rrset, set2[key]['records'])
+                if (set2count < set1count):
+                    addDiff('missing', key, record)
+                elif (set2count == set1count):
+                    addDiff('changed', key, record)
+
+    for key in set2.keys():
+        for record in set2[key]['records']:
+            if key not in set1:
+                addDiff('new', key, record)
+            elif (record not in set1[key]['records']):
+                rrset = splitRecord(record)[0]
+                set1count = countOccurances(rrset, set1[key]['records'])
+                set2count = countOccurances(rrset, set2[key]['records'])
+                if (set2count > set1count):
+                    addDiff('new', key, record)
+
+    return diff_set
+
+
+# Builds two classified snapshots of about n records each. Between the two, roughly churn
+# of the records are removed, changed and added, and some rrsets share name prefixes
+# (example.com. / example.com.au.) the way real data does.
+def syntheticSnapshots(n, churn, seed):
+    rand = random.Random(seed)
+    classes = ['spf', 'dkim', 'dmarc', 'google-site-verification', 'unknown']
+    set1 = dict((key, {'records': [], 'count': 0}) for key in classes)
+    set2 = dict((key, {'records': [], 'count': 0}) for key in classes)
+
+    i = 0
+    while i < n:
+        domain = 'domain{}.example.'.format(i)
+        if rand.random() < 0.05:
+            domain = 'domain{}.example.au.'.format(i - 1)
+        key = rand.choice(classes)
+
+        for j in range(rand.randint(1, 3)):
+            record = '{} {}-record-{}-{}'.format(domain, key, i, j)
+            i += 1
+            roll = rand.random()
+            set1[key]['records'].append(record)
+
+            if roll < churn:
+                continue
+            elif roll < churn * 2:
+                set2[key]['records'].append(record + '-changed')
+            else:
+                set2[key]['records'].append(record)
+
+            if rand.random() < churn:
+                set2[key]['records'].append('{} {}-record-{}-new'.format(domain, key, i))
+
+    for snapshot in (set1, set2):
+        for key in snapshot.keys():
+            snapshot[key]['count'] = len(snapshot[key]['records'])
+
+    return (set1, set2)
+
+
+# Converts a synthetic snapshot to the {class: [Record, ...]} form diffSet takes
+def snapshotRecords(snapshot):
+    return dict((key, [recordFromText(record) for record in snapshot[key]['records']]) for key in snapshot.keys())
+
+
+def timeCall(label, func, count):
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    sys.stdout.write("{}: {} records in {:.2f} seconds ({:.0f} records/sec)\n".format(label, count, elapsed, rate))
+    return result
+
+
+def loadDiffResults():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diff-results.py')
+    return imp.load_source('diff_results', path)
+
+
+# Fast regression checks for diffSet: the prefix collision case and equivalence with the
+# reference diff on a small pair of snapshots
+def checkDiff(args):
+    diff_results = loadDiffResults()
+
+    # example.com. changed its record while example.com.au. gained one. Counting by prefix
+    # saw 2 -> 3 records for example.com. and never reported the change.
+    set1 = {'spf': {'records': ['example.com. v=spf1 a', 'example.com.au. v=spf1 mx'], 'count': 2}}
+    set2 = {'spf': {'records': ['example.com. v=spf1 a -all', 'example.com.au. v=spf1 mx',
+        'example.com.au. v=spf1 ip4:192.0.2.1'], 'count': 3}}
+    diff_set = diff_results.diffSet(snapshotRecords(set1), snapshotRecords(set2))
+    if (diff_set['changed'].get('spf', {}).get('records') != ['example.com. v=spf1 a'] or
+            diff_set['new']['spf']['records'] != ['example.com.au. v=spf1 ip4:192.0.2.1'] or
+            diff_set['missing'] != {}):
+        sys.stderr.write("Prefix collision case diffed incorrectly: {}\n".format(diff_set))
+        sys.exit(1)
+
+    # The reference is quadratic, so equivalence is checked on a smaller pair of snapshots
+    (set1, set2) = syntheticSnapshots(args.check_records, args.churn, args.seed)
+    count = args.check_records * 2
+    expected = timeCall('linear', lambda: diffSetLinear(diff_results, set1, set2), count)
+    (records1, records2) = (snapshotRecords(set1), snapshotRecords(set2))
+    actual = timeCall('indexed', lambda: diff_results.diffSet(records1, records2), count)
+
+    if (expected != actual):
+        sys.stderr.write("Indexed diff does not match the reference on {} records\n".format(args.check_records))
+        sys.exit(1)
+    sys.stdout.write("Indexed diff matches the reference on {} records\n".format(args.check_records))
+
+
+def benchDiff(args):
+    checkDiff(args)
+    diff_results = loadDiffResults()
+
+    (set1, set2) = syntheticSnapshots(args.records, args.churn, args.seed)
+    (records1, records2) = (snapshotRecords(set1), snapshotRecords(set2))
+    diff_set = timeCall('indexed', lambda: diff_results.diffSet(records1, records2), args.records * 2)
+    for change in sorted(diff_set.keys()):
+        total = sum(diff_set[change][key]['count'] for key in diff_set[change].keys())
+        sys.stdout.write("{} {}\n".format(change, total))
+
+
+# Builds a zone of n SPF domains that all include one of a few shared provider records,
+# written to path in the format ZoneSource reads; returns the (domain, record) list
+def syntheticSpfZone(path, n, seed):
+    rand = random.Random(seed)
+    records = []
+
+    with open(path, 'w') as f:
+        for p in range(5):
+            f.write('_spf.provider{}.example. TXT "v=spf1 include:_netblocks.provider{}.example ~all"\n'.format(p, p))
+            f.write('_netblocks.provider{}.example. TXT "v=spf1 ip4:10.{}.0.0/16 ip6:2001:db8:{}::/48 ~all"\n'.format(p, p, p))
+
+        for i in range(n):
+            domain = 'domain{}.example.'.format(i)
+            record = 'v=spf1 a mx include:_spf.provider{}.example -all'.format(rand.randint(0, 4))
+            f.write('{} A 192.0.2.{}\n'.format(domain, i % 250))
+            f.write('{} MX 10 mail.{}\n'.format(domain, domain))
+            f.write('mail.{} A 198.51.100.{}\n'.format(domain, i % 250))
+            records.append((domain, record))
+
+    return records
+
+
+def benchSpf(args):
+    zone = os.path.join(args.tmpdir, 'spf-zone.txt')
+    with open(zone, 'w') as f:
+        f.write('loop1.example. TXT "v=spf1 include:loop2.example -all"\n')
+        f.write('loop2.example. TXT "v=spf1 include:loop1.example -all"\n')
+        f.write('wide.example. TXT "v=spf1 a:h1.example a:h2.example a:h3.example -all"\n')
+        f.write('h1.example. A 192.0.2.1\n')
+        f.write('redirect.example. TXT "v=spf1 ip4:192.0.2.0/24 -all"\n')
+        f.write('a.example. TXT "v=spf1 ip4:192.0.2.0/24 include:b.example -all"\n')
+        f.write('b.example. TXT "v=spf1 ip4:198.51.100.0/24 include:a.example -all"\n')
+
+    expander = SpfExpander(ZoneSource(zone), 4)
+    cases = [
+        ('loop1.example.', 'v=spf1 include:loop2.example -all', 2, ['loop:loop1.example.']),
+        ('many.example.', 'v=spf1 ' + ' '.join(['include:wide.example'] * 3) + ' -all', 12, []),
+        ('redirected.example.', '"v=spf1 " "redirect=redirect.example"', 1, []),
+    ]
+    for (domain, record, lookups, errors) in cases:
+        expansion = expander.expandRecord(domain, record)
+        if (expansion['lookups'] != lookups or expansion['errors'] != errors):
+            sys.stderr.write("SPF expansion of {} gave {}\n".format(domain, expansion))
+            sys.exit(1)
+
+    # Expanding a record inside a loop mustn't depend on which records were expanded first
+    into_b = ('y.example.', 'v=spf1 include:b.example -all')
+    fresh = SpfExpander(ZoneSource(zone), 1).expandRecord(*into_b)
+    expander = SpfExpander(ZoneSource(zone), 1)
+    expander.expandRecord('x.example.', 'v=spf1 include:a.example -all')
+    if (expander.expandRecord(*into_b) != fresh or fresh['lookups'] != 3 or len(fresh['ip4']) != 2):
+        sys.stderr.write("SPF expansion of {} depends on expansion order: {}\n".format(into_b[0], fresh))
+        sys.exit(1)
+
+    # The memoized, concurrent run has to match expanding every record from scratch
+    records = syntheticSpfZone(zone, args.records, args.seed)
+    source = ZoneSource(zone)
+    check = records[:args.check_records]
+    expected = timeCall('uncached', lambda: [SpfExpander(source, 1).expandRecord(d, r) for (d, r) in check], len(check))
+    expander = SpfExpander(source, args.workers)
+    actual = timeCall('memoized', lambda: [x for (d, r, x) in expander.run(check)], len(check))
+
+    if (expected != actual):
+        sys.stderr.write("Memoized SPF expansion does not match the reference on {} records\n".format(len(check)))
+        sys.exit(1)
+    sys.stdout.write("Memoized SPF expansion matches the reference on {} records\n".format(len(check)))
+
+    expander = SpfExpander(source, args.workers)
+    timeCall('memoized', lambda: [x for (d, r, x) in expander.run(records)], len(records))
+    sys.stdout.write("{}\n".format(expander.stats()))
+    os.remove(zone)
+
+
+# Writes a top domains CSV of n names, some of them non-ASCII (UTF-8) and some listed twice;
+# returns the names as they appear in the file
+def syntheticTopList(path, n, seed):
+    rand = random.Random(seed)
+    domains = []
+
+    with open(path, 'w') as f:
+        for rank in range(1, n + 1):
+            if (rank % 50 == 0):
+                domain = u'b\xfccher{}.example'.format(rank).encode('utf-8')
+            elif (rank % 97 == 0 and domains):
+                domain = rand.choice(domains)
+            else:
+                domain = 'domain{}.example'.format(rank)
+            f.write('{},{}\n'.format(rank, domain))
+            domains.append(domain)
+
+    return domains
+
+
+def rankLookup(topdomains, qname):
+    try:
+        return int(topdomains[qname])
+    except KeyError:
+        return None
+
+
+def benchRank(args):
+    topfile = os.path.join(args.tmpdir, 'rank-top.csv')
+    indexfile = os.path.join(args.tmpdir, 'rank-top.idx')
+    domains = ['{}.'.format(domain) for domain in syntheticTopList(topfile, args.records, args.seed)]
+
+    topdomains = activedns.buildTopdomains(topfile)
+    index = activedns.loadTopdomains(topfile, indexfile)
+
+    # Qnames decoded from JSON or avro are unicode; a non-ASCII one has to find the rank of
+    # its UTF-8 form in the CSV rather than raise UnicodeEncodeError
+    qnames = domains[:args.check_records] + ['missing{}.example.'.format(i) for i in range(100)]
+    for qname in qnames:
+        expected = rankLookup(topdomains, qname)
+        if (rankLookup(index, qname) != expected or rankLookup(index, qname.decode('utf-8')) != expected):
+            sys.stderr.write("Rank index lookup of {!r} does not match the top domains dict\n".format(qname))
+            sys.exit(1)
+
+    records = [{'qname': u'b\xfccher50.example.'}, {'qname': u'm\xfcnchen.example.'}, {'qname': u'domain1.example.'}]
+    ranked = [rank for (rank, line) in activedns.rankRecords(index, records)]
+    if (ranked != [50, 1]):
+        sys.stderr.write("rankRecords on unicode qnames gave ranks {}\n".format(ranked))
+        sys.exit(1)
+    sys.stdout.write("Rank index matches the top domains dict on {} qnames\n".format(len(qnames)))
+
+    timeCall('dict', lambda: [rankLookup(topdomains, qname) for qname in domains], len(domains))
+    timeCall('index', lambda: [rankLookup(index, qname) for qname in domains], len(domains))
+    os.remove(topfile)
+    os.remove(indexfile)
+
+
+# Builds n records of 1 to 4 ip4/ip6 networks each, drawn from a small pool so that records
+# overlap one another and sometimes themselves
+def syntheticNetworks(n, seed):
+    rand = random.Random(seed)
+    records = []
+    for i in range(n):
+        networks = []
+        for j in range(rand.randint(1, 4)):
+            kind = rand.random()
+            if kind < 0.7:
+                networks.append('10.{}.{}.0/{}'.format(rand.randint(0, 63), rand.randint(0, 255), rand.choice([16, 20, 24, 28, 32])))
+            elif kind < 0.75:
+                networks.append('10.{}.{}.0/255.255.{}.0'.format(rand.randint(0, 63), rand.randint(0, 255), rand.choice([0, 240, 255])))
+            elif kind < 0.8:
+                networks.append('10.{}/{}'.format(rand.randint(0, 63), rand.choice([16, 24])))
+            else:
+                networks.append('2001:db8:{:x}::/{}'.format(rand.randint(0, 255), rand.choice([32, 40, 48, 64])))
+        records.append(networks)
+    return records
+
+
+# Reference accounting with netaddr: IPSet merges the networks of one record, and one IPSet
+# of every network gives the distinct totals
+def addressSpaceNetaddr(netaddr, records):
+    total = netaddr.IPSet()
+    counts = []
+    for networks in records:
+        record = netaddr.IPSet(netaddr.IPNetwork(network) for network in networks)
+        counts.append((sum(n.size for n in record.iter_cidrs() if n.version == 4), sum(n.size for n in record.iter_cidrs() if n.version == 6)))
+        total.update(record)
+    cidrs = total.iter_cidrs()
+    return (counts, sum(n.size for n in cidrs if n.version == 4), sum(n.size for n in cidrs if n.version == 6))
+
+
+def addressSpaceIntervals(records):
+    total = AddressSpace()
+    counts = []
+    for networks in records:
+        record = AddressSpace()
+        for network in networks:
+            record.add(network)
+        counts.append((record.size(4), record.size(6)))
+        total.update(record)
+    return (counts, total.size(4), total.size(6))
+
+
+def benchAddresses(args):
+    import netaddr
+
+    records = syntheticNetworks(args.records, args.seed)
+    count = sum(len(networks) for networks in records)
+    expected = timeCall('netaddr', lambda: addressSpaceNetaddr(netaddr, records), count)
+    actual = timeCall('intervals', lambda: addressSpaceIntervals(records), count)
+
+    if (expected != actual):
+        sys.stderr.write("Interval address counts do not match netaddr on {} records\n".format(args.records))
+        sys.exit(1)
+    sys.stdout.write("Interval address counts match netaddr on {} records: {} ip4, {} ip6 distinct\n".format(args.records, actual[1], actual[2]))
+
+
+def timeRun(label, func, items):
+    start = time.time()
+    results = [func(x) for x in items]
+    elapsed = time.time() - start
+    rate = len(items) / elapsed if elapsed > 0 else float('inf')
+    sys.stdout.write("{}: {} records in {:.2f} seconds ({:.0f} records/sec)\n".format(label, len(items), elapsed, rate))
+    return results
+
+
+def benchClassify(args):
+    with open(args.input, 'r') as f:
+        records = [' '.join(line.split()[1:]) for line in f]
+
+    before = timeRun('reference', classify_reference.classifyTxtRecord, records)
+    after = timeRun('compiled', classifyTxtRecord, records)
+
+    mismatches = [(r, b, a) for (r, b, a) in zip(records, before, after) if b != a]
+    for (record, b, a) in mismatches[:10]:
+        sys.stderr.write("Mismatch: {} reference={} compiled={}\n".format(record, b, a))
+
+    if mismatches:
+        sys.stderr.write("{} of {} records classified differently\n".format(len(mismatches), len(records)))
+        sys.exit(1)
+
+    sys.stdout.write("All {} records classified identically\n".format(len(records)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline processing steps against their reference implementations")
+    subparsers = parser.add_subparsers()
+
+    classify_parser = subparsers.add_parser('classify', help="classifyTxtRecord over a 'domain rrdata' record list")
+    classify_parser.add_argument('input', type=str)
+    classify_parser.set_defaults(func=benchClassify)
+
+    corpus_parser = subparsers.add_parser('corpus', help="Write a synthetic 'domain rrdata' record list for the classify benchmark")
+    corpus_parser.add_argument('output', type=str)
+    corpus_parser.add_argument('--records', type=int, default=200000)
+    corpus_parser.add_argument('--seed', type=int, default=1)
+    corpus_parser.set_defaults(func=writeCorpus)
+
+    diff_parser = subparsers.add_parser('diff', help="diff-results.py diffSet on synthetic snapshots")
+    diff_parser.add_argument('--records', type=int, default=1000000, help="Records per synthetic snapshot")
+    diff_parser.add_argument('--check-records', type=int, default=5000, help="Snapshot size for the comparison with the reference diff")
+    diff_parser.add_argument('--churn', type=float, default=0.01, help="Fraction of records removed, changed and added")
+    diff_parser.add_argument('--seed', type=int, default=1)
+    diff_parser.set_defaults(func=benchDiff)
+
+    diff_check_parser = subparsers.add_parser('diff-check', help="Only the fast diff-results.py correctness checks of the diff benchmark")
+    diff_check_parser.add_argument('--check-records', type=int, default=5000, help="Snapshot size for the comparison with the reference diff")
+    diff_check_parser.add_argument('--churn', type=float, default=0.01, help="Fraction of records removed, changed and added")
+    diff_check_parser.add_argument('--seed', type=int, default=1)
+    diff_check_parser.set_defaults(func=checkDiff)
+
+    addresses_parser = subparsers.add_parser('addresses', help="address_space.py ip4/ip6 accounting against netaddr")
+    addresses_parser.add_argument('--records', type=int, default=100000, help="Synthetic SPF records")
+    addresses_parser.add_argument('--seed', type=int, default=1)
+    addresses_parser.set_defaults(func=benchAddresses)
+
+    spf_parser = subparsers.add_parser('spf', help="spf_expand.py include expansion on a synthetic zone")
+    spf_parser.add_argument('--records', type=int, default=100000, help="SPF domains in the synthetic zone")
+    spf_parser.add_argument('--check-records', type=int, default=2000, help="Records compared with an uncached expansion")
+    spf_parser.add_argument('--workers', type=int, default=EXPAND_WORKERS)
+    spf_parser.add_argument('--tmpdir', type=str, default='/tmp')
+    spf_parser.add_argument('--seed', type=int, default=1)
+    spf_parser.set_defaults(func=benchSpf)
+
+    rank_parser = subparsers.add_parser('rank', help="activedns.py rank index lookups against the top domains dict")
+    rank_parser.add_argument('--records', type=int, default=1000000, help="Domains in the synthetic top list")
+    rank_parser.add_argument('--check-records', type=int, default=100000, help="Domains compared with the top domains dict")
+    rank_parser.add_argument('--tmpdir', type=str, default='/tmp')
+    rank_parser.add_argument('--seed', type=int, default=1)
+    rank_parser.set_defaults(func=benchRank)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__': main()
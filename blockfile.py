@@ -0,0 +1,191 @@
+# blockfile.py: Block-compressed line files for the ActiveDNS intermediates. Lines are
+#   grouped into blocks of about BLOCK_SIZE bytes and each block is compressed on its own
+#   (snappy, zstd or zlib). The end of the file holds an index with the offset, line count
+#   and first and last key of every block, so a reader can decompress just the blocks it
+#   needs: one chunk of the file, or the blocks covering a key (rank) range when the lines
+#   were written in key order.
+#
+#   File layout: header (magic, codec), then per block a (compressed size, raw size) header
+#   and the compressed lines, then the JSON block index and a footer (index offset, index
+#   size, magic).
+
+import os
+import json
+import zlib
+import bisect
+import struct
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOCK_MAGIC = b'LINEBLK1'
+BLOCK_SUFFIX = '.blk'
+BLOCK_SIZE = 1 << 20
+
+FILE_HEADER = struct.Struct('<8s8s')
+BLOCK_HEADER = struct.Struct('<II')
+FILE_FOOTER = struct.Struct('<QQ8s')
+
+# Codecs in the order 'auto' picks them; zlib is always available
+CODECS = ('snappy', 'zstd', 'zlib')
+ZLIB_LEVEL = 1
+
+
+# Returns (compress, decompress) for a codec name, raising ValueError if it is unknown or
+# its module isn't installed
+def codecFunctions(codec):
+    if codec == 'snappy' and snappy is not None:
+        return (snappy.compress, snappy.uncompress)
+    if codec == 'zstd' and zstandard is not None:
+        return (zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+    if codec == 'zlib':
+        return (lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress)
+
+    if codec in CODECS:
+        raise ValueError("The {} codec needs a module that isn't installed".format(codec))
+    raise ValueError("Unknown codec {}".format(codec))
+
+
+# Resolves 'auto' to the first installed codec of CODECS
+def pickCodec(codec='auto'):
+    if codec != 'auto':
+        return codec
+    if snappy is not None:
+        return 'snappy'
+    if zstandard is not None:
+        return 'zstd'
+    return 'zlib'
+
+
+# Returns whether path is a block file (checks the magic, not the name)
+def isBlockFile(path):
+    with open(path, 'rb') as f:
+        return f.read(len(BLOCK_MAGIC)) == BLOCK_MAGIC
+
+
+# Writes lines (without their newline) into compressed blocks. Each line can carry a key;
+# the index keeps the first and last key of each block, which is what BlockReader.findBlocks
+# searches, so keys should be written in order. The file is written under a temporary name
+# and only appears under its own name once it is closed.
+class BlockWriter(object):
+
+    def __init__(self, path, codec='auto', block_size=BLOCK_SIZE):
+        self.path = path
+        self.codec = pickCodec(codec)
+        (self.compress, decompress) = codecFunctions(self.codec)
+        self.block_size = block_size
+        self.tmpfile = '{}.tmp'.format(path)
+        self.f = open(self.tmpfile, 'wb')
+        self.f.write(FILE_HEADER.pack(BLOCK_MAGIC, self.codec.encode('ascii')))
+        self.index = []
+        self.lines = []
+        self.size = 0
+        self.keys = (None, None)
+
+    def write(self, line, key=None):
+        if not self.lines:
+            self.keys = (key, key)
+        else:
+            self.keys = (self.keys[0], key)
+
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if (self.size >= self.block_size):
+            self.flush()
+
+    def flush(self):
+        if not self.lines:
+            return
+
+        raw = '\n'.join(self.lines) + '\n'
+        data = self.compress(raw)
+        self.index.append([self.f.tell(), len(self.lines), self.keys[0], self.keys[1]])
+        self.f.write(BLOCK_HEADER.pack(len(data), len(raw)))
+        self.f.write(data)
+        self.lines = []
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        offset = self.f.tell()
+        index = json.dumps(self.index)
+        self.f.write(index)
+        self.f.write(FILE_FOOTER.pack(offset, len(index), BLOCK_MAGIC))
+        self.f.close()
+        os.rename(self.tmpfile, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.tmpfile)
+
+
+# Reads a block file. blocks is the index as (offset, lines, first key, last key) tuples;
+# readBlock() decompresses a single block and lines() streams a run of them.
+class BlockReader(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+
+        (magic, codec) = FILE_HEADER.unpack(self.f.read(FILE_HEADER.size))
+        if magic != BLOCK_MAGIC:
+            raise ValueError("{} is not a block file".format(path))
+        self.codec = codec.rstrip(b'\0').decode('ascii')
+        (compress, self.decompress) = codecFunctions(self.codec)
+
+        self.f.seek(-FILE_FOOTER.size, os.SEEK_END)
+        (offset, size, magic) = FILE_FOOTER.unpack(self.f.read(FILE_FOOTER.size))
+        if magic != BLOCK_MAGIC:
+            raise ValueError("{} is truncated".format(path))
+
+        self.f.seek(offset)
+        self.blocks = [tuple(block) for block in json.loads(self.f.read(size))]
+        self.last_keys = [block[3] for block in self.blocks]
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(block[1] for block in self.blocks)
+
+    # Returns the lines of block i, without their newlines
+    def readBlock(self, i):
+        self.f.seek(self.blocks[i][0])
+        (size, raw_size) = BLOCK_HEADER.unpack(self.f.read(BLOCK_HEADER.size))
+        raw = self.decompress(self.f.read(size))
+        return raw.split('\n')[:-1]
+
+    # Yields the lines of blocks first to last - 1 (every block by default)
+    def lines(self, first=0, last=None):
+        last = len(self.blocks) if last is None else last
+        for i in range(first, last):
+            for line in self.readBlock(i):
+                yield line
+
+    # Given a key range, returns (first, last) such that blocks first to last - 1 hold every
+    # line with a key in [low, high]; only valid if the keys were written in order
+    def findBlocks(self, low, high):
+        first = bisect.bisect_left(self.last_keys, low)
+        last = first
+        while (last < len(self.blocks) and self.blocks[last][2] <= high):
+            last += 1
+        return (first, last)
@@ -3,65 +3,7 @@
 import sys
 import re
 
-PROTOCOL_ENHANCEMENT = [
-        'spf',
-        'base64',
-        'sender-id',
-        'dkim',
-        'dmarc'
-        ]
-
-DOMAIN_VERIFICATION = [
-        'google-site-verification',
-        'office365ms',
-        'amazonses',
-        'salesforce-pardot',
-        'yandex-verification',
-        'outlookmsv1',
-        'office365verifydomain',
-        'sendinblue-code',
-        'zoho-verification',
-        'mailru-domain',
-        'wmail-verification',
-        'globalsign-domain-verification',
-        'dzc',
-        'dropbox-domain-verification',
-        'cisco-ci-domain-verification',
-        'logmein-openvoice',
-        'status-page-domain-verification',
-        'firebase',
-        'workplace-domain-verification',
-        'postman-domain-verification',
-        'cloudcontrol',
-        'adobe-idp-site-verification',
-        'atlassian-domain-verification',
-        'citrix-verification-code',
-        'bugcrowd-verification',
-        'logmein-domain-confirmation',
-        'favro-verification',
-        'facebook-domain-verification',
-        'docusign',
-        'adobe-sign-verification',
-        'keybase-site-verification',
-        'loaderio',
-        'blitz',
-        'detectify-verification',
-        'have-i-been-pwned-verification',
-        'tinfoil-site-verification',
-        'botify-site-verification',
-        'spycloud-domain-verification',
-        'cloudpiercer-verification',
-        'cisco-site-verification',
-        'brave-ledger-verification',
-        'dailymotion-domain-verification'
-        ]
-
-RESOURCE_LOCATION = [
-        'symantec-mdm',
-        'ivanti-landesk',
-        'fuserserver',
-        'bittorrent'
-        ]
+from dns_audit import *
 
 
 def main():
@@ -84,21 +26,13 @@ def main():
             count = float(parts[0])
             ident = parts[1]
             ident = re.sub('\"', '' , ident)
-            found = False
-
-            if ident in PROTOCOL_ENHANCEMENT:
-                found = True
-                counts['protocol_enhancement'] += count
-
-            if ident in DOMAIN_VERIFICATION:
-                found = True
-                counts['domain_verification'] += count
 
-            if ident in RESOURCE_LOCATION:
-                found = True
-                counts['resource_location'] += count
+            # Categories come from the classifier rules file so the two never drift apart
+            category = RULE_REGISTRY.category(ident)
 
-            if not found:
+            if category in counts:
+                counts[category] += count
+            else:
                 counts['unknown'] += count
 
             counts['total'] += count
@@ -5,32 +5,207 @@
 #   through the classifer pattern match. This step is performed offline so records were
 #   gathered once, but could be re-classified many times as the data is being analyzed.
 
+import os
 import sys
 import re
 import json
+import shutil
 import argparse
+import multiprocessing
 
 from dns_audit import *
+from snapshot import *
 
 NEW_RECORD_TYPES = {}
+CLASSIFICATION_CACHE = ClassificationCache(0)
 
 
-def parseRecord(domain, record):
+# Given a Record, cleans up its rrdata and returns the classifier identifier and the Record
+def classifyRecord(record):
 
     # The " " around the record were messing with the regex matches
-    record = record.replace('"', '')
-    domain_record = '{} {}'.format(domain, record)
+    record.rdata = record.rdata.replace('"', '')
 
-    identifier = classifyTxtRecord(record)
+    return (CLASSIFICATION_CACHE.classify(record.rdata), record)
 
+
+# Splits a "domain rrdata" line into a Record, collapsing whitespace in the rrdata; returns
+# None for blank lines
+def parseLine(domain_record):
+    parts = domain_record.split()
+    if not parts:
+        return None
+    return Record(parts[0], ' '.join(parts[1:]))
+
+
+# Reads a "domain rrdata" file one line at a time and yields a Record per line. If a byte
+# range is given only the lines starting inside [start, end) are read.
+def readRecords(input_file, start=0, end=None):
+    with open(input_file, 'r') as f:
+        f.seek(start)
+        position = start
+        for domain_record in f:
+            if end is not None:
+                if position >= end:
+                    break
+                position += len(domain_record)
+
+            record = parseLine(domain_record)
+            if record:
+                yield record
+
+
+def parseRecord(record):
+    addRecord(*classifyRecord(record))
+
+
+# NEW_RECORD_TYPES keeps the "domain rrdata" text of each record, ready for the JSON output
+def addRecord(identifier, record):
     try:
-        NEW_RECORD_TYPES[identifier]['records'].append(domain_record)
+        NEW_RECORD_TYPES[identifier]['records'].append(record.text())
     except KeyError:
         NEW_RECORD_TYPES[identifier] = {}
-        NEW_RECORD_TYPES[identifier]['records'] = [domain_record]
+        NEW_RECORD_TYPES[identifier]['records'] = [record.text()]
         NEW_RECORD_TYPES[identifier]['count'] = 0
 
 
+# Streaming output: every classified record is appended to a "domain rrdata" shard for its
+# class as soon as it is seen, so only the per-class counts are held in memory
+class ShardWriter(object):
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.files = {}
+        self.counts = {}
+
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+    def shardPath(self, identifier):
+        return os.path.join(self.outdir, '{}.txt'.format(identifier))
+
+    def write(self, identifier, record):
+        try:
+            self.files[identifier].write('{}\n'.format(record.text()))
+            self.counts[identifier] += 1
+        except KeyError:
+            self.files[identifier] = open(self.shardPath(identifier), 'w')
+            self.files[identifier].write('{}\n'.format(record.text()))
+            self.counts[identifier] = 1
+
+    # Closes the shards and writes counts.json with the number of records per class
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+        with open(os.path.join(self.outdir, 'counts.json'), 'w') as f:
+            f.write("{}\n".format(json.dumps(self.counts, indent=4, sort_keys=True)))
+
+    # Appends a shard written by another writer (e.g. a worker process) to this one
+    def extend(self, identifier, path, count):
+        if identifier not in self.files:
+            self.files[identifier] = open(self.shardPath(identifier), 'w')
+            self.counts[identifier] = 0
+
+        with open(path, 'r') as f:
+            shutil.copyfileobj(f, self.files[identifier])
+        self.counts[identifier] += count
+
+    # Reads a shard back one "domain rrdata" line at a time
+    def records(self, identifier):
+        if identifier not in self.counts:
+            return
+        with open(self.shardPath(identifier), 'r') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+
+# Splits a file into about `chunks` byte ranges whose boundaries fall on line starts
+def chunkFile(input_file, chunks):
+    size = os.path.getsize(input_file)
+    bounds = [0]
+
+    with open(input_file, 'rb') as f:
+        for i in range(1, chunks):
+            f.seek(max(0, (size * i) // chunks - 1))
+            f.readline()
+            position = f.tell()
+            if (position > bounds[-1] and position < size):
+                bounds.append(position)
+
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# Worker for parallel classification. Classifies one byte range of the input and returns
+# either {identifier: [domain_record, ...]} or, when given a shard directory, the per-class
+# counts of the shards it wrote there, along with the worker's cache hits, misses and entries.
+def classifyChunk(job):
+    (input_file, start, end, outdir) = job
+    cache = CLASSIFICATION_CACHE
+    (hits, misses) = (cache.hits, cache.misses)
+
+    if outdir is None:
+        result = {}
+        for record in readRecords(input_file, start, end):
+            (identifier, record) = classifyRecord(record)
+            try:
+                result[identifier].append(record.text())
+            except KeyError:
+                result[identifier] = [record.text()]
+    else:
+        writer = ShardWriter(outdir)
+        for record in readRecords(input_file, start, end):
+            writer.write(*classifyRecord(record))
+        writer.close()
+        result = writer.counts
+
+    (hits, misses) = (cache.hits - hits, cache.misses - misses)
+    return (result, hits, misses, cache.recent(hits + misses))
+
+
+# Classifies the input with a pool of worker processes. Chunk results are merged in file
+# order, so the per-class record lists come out the same as a serial run.
+def classifyParallel(input_file, jobs, writer=None):
+    chunks = chunkFile(input_file, jobs * 4)
+    work = []
+
+    for (i, (start, end)) in enumerate(chunks):
+        outdir = None
+        if writer is not None:
+            outdir = os.path.join(writer.outdir, 'part-{:05d}'.format(i))
+        work.append((input_file, start, end, outdir))
+
+    pool = multiprocessing.Pool(jobs)
+    total_records = 0
+
+    try:
+        for (job, (result, hits, misses, entries)) in zip(work, pool.imap(classifyChunk, work)):
+            CLASSIFICATION_CACHE.hits += hits
+            CLASSIFICATION_CACHE.misses += misses
+            CLASSIFICATION_CACHE.update(entries)
+
+            for identifier in sorted(result.keys()):
+                if writer is not None:
+                    writer.extend(identifier, os.path.join(job[3], '{}.txt'.format(identifier)), result[identifier])
+                    total_records += result[identifier]
+                    continue
+
+                try:
+                    NEW_RECORD_TYPES[identifier]['records'].extend(result[identifier])
+                except KeyError:
+                    NEW_RECORD_TYPES[identifier] = {'records': result[identifier], 'count': 0}
+                total_records += len(result[identifier])
+
+            if writer is not None:
+                shutil.rmtree(job[3])
+    finally:
+        pool.close()
+        pool.join()
+
+    return total_records
+
+
 def analyzeRecordPrefix(records):
 
     sys.stdout.write("----- Looking for Patterns in Unknown Records -----\n");
@@ -47,22 +222,22 @@ def analyzeRecordPrefix(records):
         if (colon_format.match(rrdata)):
             identifier = colon_format.match(rrdata).group(1)
             try:
-                disc_record_types[identifier].append(domain)
+                disc_record_types[identifier].add(domain)
             except Exception:
-                disc_record_types[identifier] = [domain]
+                disc_record_types[identifier] = set([domain])
 
         if (equals_format.match(rrdata)):
             identifier = equals_format.match(rrdata).group(1)
             if identifier == 'k=':
                 sys.stdout.write("{} {}\n".format(domain, rrdata))
             try:
-                disc_record_types[identifier].append(domain)
+                disc_record_types[identifier].add(domain)
             except Exception:
-                disc_record_types[identifier] = [domain]
+                disc_record_types[identifier] = set([domain])
 
 
     for key in disc_record_types.keys():
-        domain_count = len(set(disc_record_types[key]))
+        domain_count = len(disc_record_types[key])
         disc_record_types[key] = domain_count
 
     sorted_record_types = sorted(disc_record_types.items(), key=lambda x: x[1])
@@ -74,39 +249,104 @@ def analyzeRecordPrefix(records):
     sys.stdout.write("----------\n");
 
 
+# Points the classifier at the requested rules file (re-reading it if it changed) and sizes
+# the classification cache, loading a saved one if given
+def setupClassifier(rules_file, cache_size, cache_file=None):
+    if (rules_file != RULE_REGISTRY.path):
+        RULE_REGISTRY.path = rules_file
+        RULE_REGISTRY.load()
+    else:
+        RULE_REGISTRY.reload()
+
+    CLASSIFICATION_CACHE.maxsize = cache_size
+    if cache_file:
+        CLASSIFICATION_CACHE.load(cache_file)
+
+
+def finishCache(cache_file):
+    if (CLASSIFICATION_CACHE.maxsize > 0):
+        sys.stdout.write("Classification cache: {}\n".format(CLASSIFICATION_CACHE.stats()))
+        if cache_file:
+            CLASSIFICATION_CACHE.save(cache_file)
+
+
+# Closes a streaming shard writer, reports the per-class counts and looks for patterns in
+# the unknown records
+def finishShards(writer):
+    writer.close()
+
+    for key in writer.counts.keys():
+        sys.stdout.write('{} {}\n'.format(key, writer.counts[key]))
+
+    analyzeRecordPrefix(writer.records('unknown'))
+
+
+# Fills in the per-class counts of NEW_RECORD_TYPES, reports them, looks for patterns in the
+# unknown records and writes the classified JSON file
+def writeRecordTypes(output_file):
+    for key in NEW_RECORD_TYPES.keys():
+        if (key != 'none'):
+            NEW_RECORD_TYPES[key]['count'] = len(NEW_RECORD_TYPES[key]['records'])
+            sys.stdout.write('{} {}\n'.format(key, NEW_RECORD_TYPES[key]['count']))
+
+    if 'unknown' in NEW_RECORD_TYPES:
+        analyzeRecordPrefix(NEW_RECORD_TYPES['unknown']['records'])
+
+    with open(output_file, 'w') as f:
+        f.write("{}\n".format(json.dumps(NEW_RECORD_TYPES, indent=4, sort_keys=True)))
+
+
 def main():
     total_records = 0
 
     parser = argparse.ArgumentParser(description="Classify a list of records into JSON format of classified groups")
     parser.add_argument('input', type=str)
     #parser.add_argument('output', type=str)
+    parser.add_argument('--rules', type=str, default=RULES_FILE, help="Classifier rules file")
+    parser.add_argument('--stream', action='store_true', help="Write per-class shards as records are classified instead of one JSON file")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes")
+    parser.add_argument('--cache-size', type=int, default=CLASSIFICATION_CACHE_SIZE, help="Number of distinct rrdata classifications to remember (0 to disable)")
+    parser.add_argument('--cache-file', type=str, help="Load the classification cache from and save it back to this file")
+    parser.add_argument('--snapshot', action='store_true', help="Also write a columnar <input>-class.snapshot directory")
     args = parser.parse_args()
     input_file = args.input
     #output_file = args.output
 
-    output_file = '{}-class.json'.format(re.search('(.+)\.txt', input_file).group(1))
+    # Pick up any edits to the rules file made since the registry was loaded
+    setupClassifier(args.rules, args.cache_size, args.cache_file)
 
-    with open(input_file, 'r') as f:
-        for domain_record in f:
-            parts = domain_record.split()
-            domain = parts[0]
-            rrdata = ' '.join(parts[1:])
-            parseRecord(domain, rrdata)
-            total_records += 1
+    output_base = re.search('(.+)\.txt', input_file).group(1)
+    output_file = '{}-class.json'.format(output_base)
 
-    for key in NEW_RECORD_TYPES.keys():
-        if (key != 'none'):
-            NEW_RECORD_TYPES[key]['count'] = len(NEW_RECORD_TYPES[key]['records'])
-            sys.stdout.write('{} {}\n'.format(key, NEW_RECORD_TYPES[key]['count']))
+    if args.stream:
+        writer = ShardWriter('{}-class'.format(output_base))
+        if (args.jobs > 1):
+            total_records = classifyParallel(input_file, args.jobs, writer)
+        else:
+            for record in readRecords(input_file):
+                writer.write(*classifyRecord(record))
+                total_records += 1
+        finishShards(writer)
 
-    unknown_records = NEW_RECORD_TYPES['unknown']['records']
-    analyzeRecordPrefix(unknown_records)
+        if args.snapshot:
+            writeSnapshot('{}-class.snapshot'.format(output_base),
+                    dict((key, (recordFromText(record) for record in writer.records(key))) for key in writer.counts.keys()))
 
-    with open(output_file, 'w') as f:
-        f.write("{}\n".format(json.dumps(NEW_RECORD_TYPES, indent=4, sort_keys=True)))
-    f.close()
+    else:
+        if (args.jobs > 1):
+            total_records = classifyParallel(input_file, args.jobs)
+        else:
+            for record in readRecords(input_file):
+                parseRecord(record)
+                total_records += 1
+        writeRecordTypes(output_file)
+
+        if args.snapshot:
+            writeSnapshot('{}-class.snapshot'.format(output_base),
+                    dict((key, (recordFromText(record) for record in NEW_RECORD_TYPES[key]['records'])) for key in NEW_RECORD_TYPES.keys()))
 
     sys.stdout.write("{} Records Classified\n".format(total_records))
+    finishCache(args.cache_file)
 
 
 if __name__ == '__main__': main()
@@ -9,98 +9,94 @@ import sys
 import re
 import json
 import argparse
+import collections
 
+from snapshot import *
 
-def diffSet(set1, set2):
 
-    diff_set = { 'changed' : {}, 'missing' : {}, 'new': {} }
+# Per-class index of a result set: rrset -> multiset (Counter) of rdata, plus the number of
+# records held by each rrset
+class RecordIndex(object):
 
-    for key in set1.keys():
-        for record in set1[key]['records']:
+    def __init__(self, records):
+        self.rrsets = {}
+        self.counts = {}
+
+        for record in records:
             try:
-                if (record not in set2[key]['records']):
-                    #sys.stdout.write('{}\n'.format(record))
-
-                    (rrset, rdata) = splitRecord(record)
-                    set1count = countOccurances(rrset, set1[key]['records'])
-                    set2count = countOccurances(rrset, set2[key]['records'])
-
-                    # If the record isn't in set 2 and there are fewer records, its gone
-                    if (set2count < set1count):
-                        try:
-                            diff_set['missing'][key]['records'].append(record)
-                            diff_set['missing'][key]['count'] += 1
-                        except KeyError:
-                            diff_set['missing'][key] = {}
-                            diff_set['missing'][key]['records'] = [record]
-                            diff_set['missing'][key]['count'] = 1
-
-                    # If the record isn't in set 2 and the record count is the same, it changed
-                    elif (set2count == set1count):
-                        try:
-                            diff_set['changed'][key]['records'].append(record)
-                            diff_set['changed'][key]['count'] += 1
-                        except KeyError:
-                            diff_set['changed'][key] = {}
-                            diff_set['changed'][key]['records'] = [record]
-                            diff_set['changed'][key]['count'] = 1
-
-                    
+                self.rrsets[record.domain][record.rdata] += 1
+                self.counts[record.domain] += 1
             except KeyError:
-                #sys.stdout.write('{}\n'.format(record))
-                try:
-                    diff_set['missing'][key]['records'].append(record)
-                    diff_set['missing'][key]['count'] += 1
-                except KeyError:
-                    diff_set['missing'][key] = {}
-                    diff_set['missing'][key]['records'] = [record]
-                    diff_set['missing'][key]['count'] = 1
+                self.rrsets[record.domain] = collections.Counter([record.rdata])
+                self.counts[record.domain] = 1
+
+    def contains(self, rrset, rdata):
+        try:
+            return self.rrsets[rrset][rdata] > 0
+        except KeyError:
+            return False
+
+    # Number of records in exactly this rrset. The old list scan used startswith, which
+    # also counted records of longer names (example.com. matched example.com.au.).
+    def countOccurances(self, rrset):
+        return self.counts.get(rrset, 0)
+
+
+def addDiff(diff_set, change, key, record):
+    record = record.text()
+    try:
+        diff_set[change][key]['records'].append(record)
+        diff_set[change][key]['count'] += 1
+    except KeyError:
+        diff_set[change][key] = {}
+        diff_set[change][key]['records'] = [record]
+        diff_set[change][key]['count'] = 1
+
+
+# Given two result sets as {class: [Record, ...]} (see loadRecords), returns the records
+# missing from, changed in and new to the second set, per class
+def diffSet(set1, set2):
 
-    for key in set2.keys():
-        for record in set2[key]['records']:
-            try:
-                if (record not in set1[key]['records']):
-
-                    (rrset, rdata) = splitRecord(record)
-                    set1count = countOccurances(rrset, set1[key]['records'])
-                    set2count = countOccurances(rrset, set2[key]['records'])
-
-                    # If the record isn't in set 2 and the record count increased, it's new
-                    if (set2count > set1count):
-                        try:
-                            diff_set['new'][key]['records'].append(record)
-                            diff_set['new'][key]['count'] += 1
-                        except KeyError:
-                            diff_set['new'][key] = {}
-                            diff_set['new'][key]['records'] = [record]
-                            diff_set['new'][key]['count'] = 1
+    diff_set = { 'changed' : {}, 'missing' : {}, 'new': {} }
 
-            except KeyError:
-                try:
-                    diff_set['new'][key]['records'].append(record)
-                    diff_set['new'][key]['count'] += 1
-                except KeyError:
-                    diff_set['new'][key] = {}
-                    diff_set['new'][key]['records'] = [record]
-                    diff_set['new'][key]['count'] = 1
+    index1 = dict((key, RecordIndex(set1[key])) for key in set1.keys())
+    index2 = dict((key, RecordIndex(set2[key])) for key in set2.keys())
 
-    return diff_set
+    for key in set1.keys():
+        if key not in index2:
+            for record in set1[key]:
+                addDiff(diff_set, 'missing', key, record)
+            continue
+
+        for record in set1[key]:
+            if not index2[key].contains(record.domain, record.rdata):
+                set1count = index1[key].countOccurances(record.domain)
+                set2count = index2[key].countOccurances(record.domain)
 
+                # If the record isn't in set 2 and there are fewer records, its gone
+                if (set2count < set1count):
+                    addDiff(diff_set, 'missing', key, record)
 
-def splitRecord(record):
-    rparts = record.split()
-    rrset = rparts[0]
-    rdata = ' '.join(rparts[1:])
-    return (rrset, rdata)
+                # If the record isn't in set 2 and the record count is the same, it changed
+                elif (set2count == set1count):
+                    addDiff(diff_set, 'changed', key, record)
 
+    for key in set2.keys():
+        if key not in index1:
+            for record in set2[key]:
+                addDiff(diff_set, 'new', key, record)
+            continue
+
+        for record in set2[key]:
+            if not index1[key].contains(record.domain, record.rdata):
+                set1count = index1[key].countOccurances(record.domain)
+                set2count = index2[key].countOccurances(record.domain)
 
-def countOccurances(rrset, records):
-    count = 0
-    for record in records:
-        if record.startswith(rrset):
-            count += 1
+                # If the record isn't in set 2 and the record count increased, it's new
+                if (set2count > set1count):
+                    addDiff(diff_set, 'new', key, record)
 
-    return count
+    return diff_set
 
 
 def main():
@@ -116,11 +112,8 @@ def main():
     set2file = args.set2
     output = args.output
 
-    with open(set1file, 'r') as f:
-        set1 = json.load(f)
-
-    with open(set2file, 'r') as f:
-        set2 = json.load(f)
+    set1 = loadRecords(set1file)
+    set2 = loadRecords(set2file)
 
     diff_set = diffSet(set1, set2)
 
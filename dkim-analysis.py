@@ -7,26 +7,25 @@ import sys
 import netaddr
 from netaddr import *
 
+from snapshot import *
+
 
 def main():
-    parser = argparse.ArgumentParser(description="Given the JSON output of a classified result set, performs some metrics on DKIM records")
+    parser = argparse.ArgumentParser(description="Given the JSON output (or snapshot) of a classified result set, performs some metrics on DKIM records")
     parser.add_argument('input', type=str)
     args = parser.parse_args()
     records_file = args.input
     
-    data = json.load(open(records_file))
-
 
     total = 0
     key_digests = {}
     key_types = {}
     services = {}
 
-    for record in data['dkim']['records']:
+    for (domain, rdata) in readClass(records_file, 'dkim'):
         total += 1
-        record = record.replace('\\', '') # squish all the leftover escapes from jsonifying
-        parts = record.split(';')
-        domain = parts[0]
+        rdata = rdata.replace('\\', '') # squish all the leftover escapes from jsonifying
+        parts = rdata.split(';')
         key_type_found = False
         for part in parts:
             part = re.sub('\s+', '', part) # collapse whitespace
@@ -56,7 +55,7 @@ def main():
                     services[service] = 1
 
         if not key_type_found:
-            sys.stderr.write('No key type found: {}\n'.format(record))
+            sys.stderr.write('No key type found: {} {}\n'.format(domain, rdata))
 
 
     sys.stdout.write('----- DKIM Analysis -----\n')
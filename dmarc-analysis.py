@@ -7,42 +7,66 @@ import sys
 import netaddr
 from netaddr import *
 
+from snapshot import *
+
+# Bit flags for the per-domain coverage index
+PROTOCOLS = [('spf', 1), ('dkim', 2), ('dmarc', 4), ('sender-id', 8)]
+FLAGS = dict(PROTOCOLS)
+
+
+# DMARC policies live at _dmarc.<domain> and DKIM keys at <selector>._domainkey.<domain>;
+# strip those labels so the coverage matrix joins every protocol on the domain it protects
+def ownerDomain(name):
+    if name.startswith('_dmarc.'):
+        return name[len('_dmarc.'):]
+
+    index = name.find('_domainkey.')
+    if (index == 0 or (index > 0 and name[index - 1] == '.')):
+        return name[index + len('_domainkey.'):]
+
+    return name
+
+
+# Sets flag for a record's name as published (names) and for the domain it protects (coverage)
+def markDomain(coverage, names, domain, flag):
+    names[domain] = names.get(domain, 0) | flag
+    owner = ownerDomain(domain)
+    coverage[owner] = coverage.get(owner, 0) | flag
+
 
 def main():
-    parser = argparse.ArgumentParser(description="Given the JSON output of a classified result set, performs some metrics on DMARC records")
+    parser = argparse.ArgumentParser(description="Given the JSON output (or snapshot) of a classified result set, performs some metrics on DMARC records")
     parser.add_argument('input', type=str)
+    parser.add_argument('--coverage', type=str, help="Write each domain's SPF/DKIM/DMARC/SenderID presence to this CSV file")
     args = parser.parse_args()
     records_file = args.input
     
-    data = json.load(open(records_file))
-
     total = 0
     policies = {'none': 0, 'reject': 0, 'quarantine': 0, 'monitor': 0}
     return_addresses = {'rua': 0, 'ruf': 0, 'both': 0, 'neither': 0}
     other_txt = {'spf': 0, 'dkim': 0, 'both': 0, 'neither': 0}
 
-    spf_domains = []
-    for record in data['spf']['records']:
-        spf_domains.append(record.split()[0])
-
+    # name -> bitmask of the protocols published at exactly that name, and owner domain ->
+    # bitmask for the coverage matrix, filled in one pass over each class. The Other TXT
+    # Records counts match SPF and DKIM records on the DMARC record's own name.
+    names = {}
+    coverage = {}
+    for (rclass, flag) in PROTOCOLS:
+        if rclass != 'dmarc':
+            for (domain,) in readClass(records_file, rclass, ('domain',)):
+                markDomain(coverage, names, domain, flag)
 
-    dkim_domains = []
-    for record in data['dkim']['records']:
-        dkim_domains.append(record.split()[0])
 
-
-
-    for record in data['dmarc']['records']:
+    for (domain, rdata) in readClass(records_file, 'dmarc'):
+        markDomain(coverage, names, domain, FLAGS['dmarc'])
         total += 1
-        record = record.replace('\\', '') # squish all the leftover escapes from jsonifying
-        parts = record.split()
-        domain = parts[0]
-        parts = ' '.join(parts[1:]).split(';')
+        rdata = rdata.replace('\\', '') # squish all the leftover escapes from jsonifying
+        parts = rdata.split(';')
 
         found_rua = False
         found_ruf = False
-        has_spf = (domain in spf_domains)
-        has_dkim = (domain in dkim_domains)
+        has_spf = bool(names[domain] & FLAGS['spf'])
+        has_dkim = bool(names[domain] & FLAGS['dkim'])
 
 
         for part in parts:
@@ -94,6 +118,23 @@ def main():
     sys.stdout.write('Other TXT Records\n')
     for txt in other_txt.keys():
         sys.stdout.write('{}: {}\n'.format(txt, other_txt[txt]))
+
+    matrix = {}
+    for mask in coverage.values():
+        matrix[mask] = matrix.get(mask, 0) + 1
+
+    sys.stdout.write('Coverage Matrix ({})\n'.format(' '.join(rclass for (rclass, flag) in PROTOCOLS)))
+    for mask in sorted(matrix.keys(), reverse=True):
+        flags = ' '.join(('Y' if mask & flag else 'N') for (rclass, flag) in PROTOCOLS)
+        sys.stdout.write('{}: {}\n'.format(flags, matrix[mask]))
+    sys.stdout.write('Total domains: {}\n'.format(len(coverage)))
+
+    if args.coverage:
+        with open(args.coverage, 'w') as out_f:
+            out_f.write('domain,{}\n'.format(','.join(rclass for (rclass, flag) in PROTOCOLS)))
+            for domain in sorted(coverage.keys()):
+                flags = [str(bool(coverage[domain] & flag)) for (rclass, flag) in PROTOCOLS]
+                out_f.write('{},{}\n'.format(domain, ','.join(flags)))
             
 
 
@@ -2,18 +2,47 @@
 # Date: October 23, 2017
 # dns-audit.py: Library functions to support DNS TXT record research
 
+import os
 import re
 import sys
+import json
 import time
+import array
+import heapq
+import bisect
+import struct
+import hashlib
+import random
+import threading
+import collections
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 from dns.resolver import *
 
 NO_NAMESERVER_TIMEOUT=10
 NO_NAMESERVER_MAX_TRIES=3
+NO_NAMESERVER_MAX_TIMEOUT=300
+
+FETCH_WORKERS=64
+FETCH_QPS=2000
+FETCH_CHECKPOINT_RECORDS=10000
+FETCH_CHECKPOINT_SECONDS=60
+FETCH_OUTPUT_BUFFER=1 << 20
+
+CLASSIFICATION_CACHE_SIZE=100000
+
+DOMAIN_HASH_CHUNK=1000000
+
+# Native 64-bit integer, for the hash arrays on platforms where C long is 32 bits
+DOMAIN_HASH_STRUCT = struct.Struct('=q')
 
 
 # Given a dnspython resolver object, trues to resolve a TXT record and returns the rrset
-def lookupTxtRecord(record, resolver, tries=0):
+def lookupTxtRecord(record, resolver, tries=0, max_tries=NO_NAMESERVER_MAX_TRIES):
 
     answers = []
     resolved = False
@@ -30,15 +59,17 @@ def lookupTxtRecord(record, resolver, tries=0):
         resolved = True
 
     # SERVFAIL
+    # With max_tries=1 the error is raised straight away so the caller can schedule the retry
     except dns.resolver.NoNameservers:
-        sys.stderr.write("NoNameserver for {}, trying in {} seconds\n".format(record, NO_NAMESERVER_TIMEOUT))
         tries += 1
 
-        if (tries < NO_NAMESERVER_MAX_TRIES):
+        if (tries < max_tries):
+            sys.stderr.write("NoNameserver for {}, trying in {} seconds\n".format(record, NO_NAMESERVER_TIMEOUT))
             time.sleep(NO_NAMESERVER_TIMEOUT)
-            answers = lookupTxtRecord(record, resolver, tries)
+            answers = lookupTxtRecord(record, resolver, tries, max_tries)
         else:
-            sys.stderr.write("Max tries {} reached trying to resolve {}\n".format(NO_NAMESERVER_MAX_TRIES, record))
+            if (max_tries > 1):
+                sys.stderr.write("Max tries {} reached trying to resolve {}\n".format(max_tries, record))
             raise
 
     except dns.exception.Timeout:
@@ -48,401 +79,644 @@ def lookupTxtRecord(record, resolver, tries=0):
     return answers
 
 
+# Simple thread-safe token bucket used to cap the query rate across all fetch workers
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    # Blocks the calling thread until a token is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if (self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# Delayed retry queue for names that hit SERVFAIL / NoNameservers. Each failure pushes the
+# name back with an exponentially growing, jittered delay; names that fail max_tries times
+# are moved to the given_up list instead.
+class RetryScheduler(object):
+
+    def __init__(self, max_tries=NO_NAMESERVER_MAX_TRIES, base_delay=NO_NAMESERVER_TIMEOUT,
+            max_delay=NO_NAMESERVER_MAX_TIMEOUT):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = {}
+        self.given_up = []
+        self.heap = []
+
+    # Records a failed attempt for name; returns the retry delay, or None if giving up
+    def schedule(self, name):
+        tries = self.attempts.get(name, 0) + 1
+        self.attempts[name] = tries
+
+        if (tries >= self.max_tries):
+            self.given_up.append(name)
+            return None
+
+        delay = min(self.max_delay, self.base_delay * (2 ** (tries - 1)))
+        delay = random.uniform(delay / 2.0, delay)
+        heapq.heappush(self.heap, (time.time() + delay, name))
+        return delay
+
+    # Pops and returns every name whose retry time has passed
+    def due(self):
+        names = []
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            names.append(heapq.heappop(self.heap)[1])
+        return names
+
+    def pending(self):
+        return len(self.heap)
+
+    # Seconds until the next retry is due, or None if nothing is waiting
+    def wait(self):
+        if not self.heap:
+            return None
+        return max(0, self.heap[0][0] - time.time())
+
+
+# Concurrent TXT lookup engine; keeps up to `workers` queries in flight against the
+# given nameservers while holding the overall rate under `qps` queries per second
+class TxtFetcher(object):
+
+    def __init__(self, nameservers, port=53, workers=FETCH_WORKERS, qps=FETCH_QPS, retry=None):
+        self.nameservers = nameservers
+        self.port = port
+        self.workers = workers
+        self.bucket = TokenBucket(qps) if qps else None
+        self.retry = retry if retry else RetryScheduler()
+        self.local = threading.local()
+
+    # dnspython resolvers are not shared between threads, each worker gets its own
+    def resolver(self):
+        try:
+            return self.local.resolver
+        except AttributeError:
+            resolver = dns.resolver.Resolver()
+            resolver.nameservers = self.nameservers
+            resolver.port = self.port
+            self.local.resolver = resolver
+            return resolver
+
+    def worker(self, in_q, out_q):
+        while True:
+            name = in_q.get()
+            if name is None:
+                break
+
+            if self.bucket:
+                self.bucket.acquire()
+
+            try:
+                out_q.put((name, lookupTxtRecord(name, self.resolver(), max_tries=1), None))
+            except Exception as e:
+                out_q.put((name, [], e))
+
+    # Given an iterable of rrset names, yields (name, answers, error) tuples as lookups
+    # complete; error is None unless the lookup raised. NoNameservers failures are handed
+    # to the retry scheduler and only reported once the name has been given up on.
+    def run(self, names):
+        in_q = queue.Queue()
+        out_q = queue.Queue()
+        threads = []
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker, args=(in_q, out_q))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        inflight = 0
+        names = iter(names)
+        exhausted = False
+
+        try:
+            while True:
+                for name in self.retry.due():
+                    in_q.put(name)
+                    inflight += 1
+
+                # Keep the input queue topped up without reading the whole list into memory
+                while not exhausted and inflight < self.workers * 2:
+                    try:
+                        in_q.put(next(names))
+                        inflight += 1
+                    except StopIteration:
+                        exhausted = True
+
+                if inflight == 0:
+                    if not self.retry.pending():
+                        break
+                    time.sleep(self.retry.wait())
+                    continue
+
+                try:
+                    (name, answers, error) = out_q.get(True, self.retry.wait())
+                except queue.Empty:
+                    continue
+                inflight -= 1
+
+                if isinstance(error, dns.resolver.NoNameservers):
+                    delay = self.retry.schedule(name)
+                    if delay is not None:
+                        sys.stderr.write("NoNameserver for {}, retrying in {:.1f} seconds\n".format(name, delay))
+                        continue
+                    sys.stderr.write("Max tries {} reached trying to resolve {}\n".format(self.retry.max_tries, name))
+
+                yield (name, answers, error)
+
+        finally:
+            for t in threads:
+                in_q.put(None)
+            for t in threads:
+                t.join()
+
+
+# Progress journal for the fetch scripts, so a run that dies can resume where it stopped.
+# Names are read from the input file with their byte offsets; as lookups complete (in any
+# order) the journal tracks the offset below which every name is done, plus the completed
+# offsets past it. Every checkpoint_records completions (or checkpoint_seconds) the outputs
+# are flushed and a JSON line with that state and the size of each output is appended to
+# the journal. On restart the outputs are truncated back to the last checkpoint's sizes and
+# only the names not yet done are read again, so nothing is lost or written twice.
+class FetchJournal(object):
+
+    def __init__(self, path, input_path, checkpoint_records=FETCH_CHECKPOINT_RECORDS,
+            checkpoint_seconds=FETCH_CHECKPOINT_SECONDS):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.checkpoint_records = checkpoint_records
+        self.checkpoint_seconds = checkpoint_seconds
+        self.outputs = collections.OrderedDict()
+        self.logs = []
+        self.issued = collections.deque()
+        self.pending = {}
+        self.completed = set()
+        self.position = 0
+        self.since_checkpoint = 0
+        self.last_checkpoint = time.time()
+
+        state = self.load()
+        self.resuming = state is not None
+        if state is None:
+            state = {'input': self.input_path, 'offset': 0, 'done': [], 'outputs': {}}
+        elif state['input'] != self.input_path:
+            raise ValueError("{} is the journal of {}, not {}".format(path, state['input'], self.input_path))
+
+        self.offset = state['offset']
+        self.done = set(state['done'])
+        self.sizes = state['outputs']
+
+        # Start the journal over from the state resumed from, dropping any torn last line. The
+        # new journal replaces the old one in a single rename, so a crash here can't leave an
+        # empty journal that would make the next run start over and truncate the outputs.
+        if self.resuming:
+            tmpfile = '{}.tmp'.format(path)
+            with open(tmpfile, 'w') as f:
+                f.write("{}\n".format(json.dumps(state)))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpfile, path)
+            self.journal_f = open(path, 'a')
+        else:
+            self.journal_f = open(path, 'w')
+
+    # Returns the last complete checkpoint in the journal, or None if there isn't one
+    def load(self):
+        if not os.path.isfile(self.path):
+            return None
+
+        state = None
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    state = json.loads(line)
+                except ValueError:
+                    pass
+        return state
+
+    def writeState(self, state):
+        self.journal_f.write("{}\n".format(json.dumps(state)))
+        self.journal_f.flush()
+        os.fsync(self.journal_f.fileno())
+
+    # Opens an output through a single buffered handle. A fresh run truncates it and a resumed
+    # run cuts it back to its size at the last checkpoint. Logs shared with other runs (append)
+    # are only ever appended to and flushed at checkpoints, never cut back, so lines logged
+    # after the last checkpoint may be logged again on resume.
+    def openOutput(self, path, append=False):
+        path = os.path.abspath(path)
+        if append:
+            f = open(path, 'a', FETCH_OUTPUT_BUFFER)
+            self.logs.append(f)
+            return f
+
+        if self.resuming and os.path.isfile(path):
+            f = open(path, 'r+', FETCH_OUTPUT_BUFFER)
+            f.truncate(self.sizes.get(path, 0))
+            f.seek(0, os.SEEK_END)
+        else:
+            f = open(path, 'w', FETCH_OUTPUT_BUFFER)
+
+        self.outputs[path] = f
+        return f
+
+    # Yields the names of the input that aren't done yet, one per non-blank line. Call once
+    # the outputs are open: the starting sizes are checkpointed first.
+    def readNames(self):
+        self.position = self.offset
+        self.checkpoint()
+        with open(self.input_path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+
+                offset = self.position
+                self.position += len(line)
+                name = line.rstrip()
+                if not name or offset in self.done:
+                    continue
+
+                self.issued.append(offset)
+                self.pending.setdefault(name, collections.deque()).append(offset)
+                yield name
+
+    # Marks one lookup of name as done, checkpointing when one is due
+    def complete(self, name):
+        offsets = self.pending[name]
+        self.completed.add(offsets.popleft())
+        if not offsets:
+            del self.pending[name]
+
+        self.since_checkpoint += 1
+        if (self.since_checkpoint >= self.checkpoint_records or
+                time.time() - self.last_checkpoint >= self.checkpoint_seconds):
+            self.checkpoint()
+
+    # Flushes the outputs and appends the current state to the journal
+    def checkpoint(self):
+        while self.issued and self.issued[0] in self.completed:
+            self.completed.remove(self.issued.popleft())
+        offset = self.issued[0] if self.issued else self.position
+
+        for f in self.logs:
+            f.flush()
+
+        sizes = {}
+        for (path, f) in self.outputs.items():
+            f.flush()
+            os.fsync(f.fileno())
+            sizes[path] = f.tell()
+
+        done = sorted(self.completed | set(o for o in self.done if o >= offset))
+        self.writeState({'input': self.input_path, 'offset': offset, 'done': done, 'outputs': sizes})
+
+        self.since_checkpoint = 0
+        self.last_checkpoint = time.time()
+
+    # Closes the outputs of a finished run and removes the journal
+    def finish(self):
+        for f in list(self.outputs.values()) + self.logs:
+            f.close()
+        self.journal_f.close()
+        os.remove(self.path)
+
+
+# Classifier rules live in a JSON file next to this module. Rules are tried in file order and
+# the first match wins. Each rule has an identifier, a category (used by categorize.py), a
+# match type and a list of patterns:
+#   prefix   - record starts with a pattern (compared against the lowercased record)
+#   contains - pattern appears anywhere in the record
+#   regex    - pattern matches at the start of the record
+#   suffix   - record ends with a pattern
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classifier-rules.json')
+
+
+# Given an ordered list of prefix rules, compiles them into one anchored alternation and a map
+# of prefix to identifier. Python's regex alternation tries the branches left to right, so the
+# matched text is always the prefix of the earliest matching rule.
+def compilePrefixRules(rules):
+    identifiers = {}
+    alternatives = []
+
+    for rule in rules:
+        for prefix in rule['patterns']:
+            prefix = str(prefix).lower()
+            if prefix not in identifiers:
+                identifiers[prefix] = str(rule['identifier'])
+                alternatives.append(re.escape(prefix))
+
+    return (re.compile('|'.join(alternatives)), identifiers)
+
+
+# Loads the classifier rules file and compiles it into an ordered list of matchers. Runs of
+# consecutive prefix rules share a single compiled alternation so a record is lowercased and
+# scanned once per run rather than once per rule.
+class RuleRegistry(object):
+
+    def __init__(self, path=RULES_FILE):
+        self.path = path
+        self.mtime = None
+        self.load()
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            content = f.read()
+
+        self.mtime = os.path.getmtime(self.path)
+        self.fingerprint = hashlib.sha1(content).hexdigest()
+        self.rules = json.loads(content.decode('utf-8'))['rules']
+        self.categories = dict((rule['identifier'], rule['category']) for rule in self.rules)
+        self.matchers = []
+
+        prefix_run = []
+        for rule in self.rules + [None]:
+            if rule is not None and rule['match'] == 'prefix':
+                prefix_run.append(rule)
+                continue
+
+            if prefix_run:
+                (pattern, identifiers) = compilePrefixRules(prefix_run)
+                self.matchers.append(('prefix', pattern, identifiers))
+                prefix_run = []
+
+            if rule is None:
+                break
+
+            # Rule files are unicode after json decoding; keep patterns as native strings
+            patterns = [str(x) for x in rule['patterns']]
+            if rule['match'] == 'regex':
+                patterns = [re.compile(x) for x in patterns]
+            elif rule['match'] == 'suffix':
+                patterns = tuple(patterns)
+            elif rule['match'] != 'contains':
+                raise ValueError("Unknown match type {} for rule {}".format(rule['match'], rule['identifier']))
+
+            self.matchers.append((rule['match'], patterns, str(rule['identifier'])))
+
+    # Reloads the rules if the file changed on disk since it was last read; returns True if so
+    def reload(self):
+        if os.path.getmtime(self.path) != self.mtime:
+            self.load()
+            return True
+        return False
+
+    def category(self, identifier):
+        return self.categories.get(identifier)
+
+    def classify(self, record):
+        lowered = None
+
+        for (match, patterns, identifier) in self.matchers:
+            if match == 'prefix':
+                if lowered is None:
+                    lowered = record.lower()
+                found = patterns.match(lowered)
+                if found:
+                    return identifier[found.group(0)]
+
+            elif match == 'contains':
+                for pattern in patterns:
+                    if pattern in record:
+                        return identifier
+
+            elif match == 'regex':
+                for pattern in patterns:
+                    if pattern.match(record):
+                        return identifier
+
+            elif record.endswith(patterns):
+                return identifier
+
+        return 'unknown'
+
+
+RULE_REGISTRY = RuleRegistry()
+
+
 # Given a DNS TXT record, performs a series of pattern matches and attempts to classify it
 def classifyTxtRecord(record):
 
     # The " " around the record were messing with the regex matches
     record = record.replace('"', '')
 
-    identifier = ""
-
-    ##### Formal TXT Record Formats #####
-
-    # SPF Records
-    if (record.lower().startswith('v=spf1')):
-        identifier = 'spf'
+    return RULE_REGISTRY.classify(record)
+
+
+# Cache keys are the raw rdata byte strings, which needn't be valid UTF-8. The cache file
+# holds them decoded as latin-1, which maps every byte to one character and back.
+CACHE_KEY_ENCODING = 'latin-1'
+
+
+def encodeCacheKey(record):
+    if isinstance(record, bytes) and bytes is str:
+        return record.decode(CACHE_KEY_ENCODING)
+    return record
 
-    # Malformed or multi-line SPF records
-    elif (record.lower().startswith('include:') or
-            record.lower().startswith('v=spf3') or
-            record.lower().startswith('ip4:')):
-        identifier = 'spf-misconfigured'
 
-    # SenderID records
-    elif (record.lower().startswith('spf2.0/')):
-        identifier = 'sender-id'
+def decodeCacheKey(record):
+    if bytes is str:
+        try:
+            return record.encode(CACHE_KEY_ENCODING)
+        except UnicodeError:
+            pass
+    return record
+
+
+# Bounded LRU memo of classifyTxtRecord keyed by the quote-stripped rdata. The same SPF
+# includes, DKIM keys and placeholder strings repeat across millions of domains, so most
+# lookups after the first few thousand records are hits. A saved cache is tied to the
+# fingerprint of the rules file and is ignored if the rules have changed since.
+class ClassificationCache(object):
 
-    # Malformed or multi-line SenderID records
-    elif (record.lower().startswith('v=spf2.0')):
-        identifier = 'sender-id-misconfigured'
-
-    # DKIM records
-    elif (record.lower().startswith('v=dkim1')):
-        identifier = 'dkim'
-
-    # Malformed or multi-line DKIM records
-    elif (record.lower().startswith('k=rsa')):
-        identifier = 'dkim-misconfigured'
-
-    # DMARC records
-    elif (record.lower().startswith('v=dmarc1')):
-        identifier = 'dmarc'
-
-    ##### END Formal TXT Record Formats #####
-
-    ##### Informal TXT Record Formats #####
-
-    #### Domain Verification ####
-    
-    ### Email SaaS Verification ###
-
-    # G Suite domain verfication
-    # https://support.google.com/a/answer/183895?hl=en
-    elif (record.lower().startswith('google-site-verification')):
-        identifier = 'google-site-verification'
-
-    # Office 365 domain ownership verification
-    # https://support.office.microsoft.com/en-us/article/Gather-the-information-you-need-to-create-Office-365-DNS-records-77f90d4a-dc7f-4f09-8972-c1b03ea85a67
-    elif (record.lower().startswith('ms=')):
-        identifier = 'office365ms'
-
-    # Outlook.com domain ownership verification
-    # http://www.omegaweb.com/how-to-configure-a-custom-domain-with-outlook-com/
-    # https://support.office.com/en-us/article/Use-your-own-domain-in-Outlook-com-Premium-61e21366-c809-44e5-a414-9bab47110e5f?ui=en-US&rs=en-US&ad=US
-    elif (record.lower().startswith('v=msv1')):
-        identifier = 'outlookmsv1'
-
-    # Another Office 365 domain ownership verification format
-    # http://www.colome.org/office-365-dns-configuration/
-    elif (record.lower().startswith('v=verifydomain')):
-        identifier = 'office365verifydomain'
-
-    # Amazon Simple Email Service (SES)
-    # http://docs.aws.amazon.com/ses/latest/DeveloperGuide/dns-txt-records.html
-    elif (record.lower().startswith('amazonses')):
-        identifier = 'amazonses'
-
-    # Domain uses the Salesforce Pardot email marketing platform
-    # http://help.pardot.com/customer/portal/articles/2128543-setting-up-tracker-subdomain-cname-
-    elif (record.lower().startswith('pardot')):
-        identifier = 'salesforce-pardot'
-
-    # Domain uses postmaster.mail.ru service for collecting mail statistics
-    # https://serverfault.com/questions/767718/what-is-dns-txt-record-mailru-verification
-    elif (record.lower().startswith('mailru-verification')):
-        identifier = 'mailru-verification'
-
-    # Domain uses the Yandex platform for managing email
-    # https://yandex.com/support/webmaster/service/rights.html
-    elif (record.lower().startswith('yandex-verification')):
-        identifier = 'yandex-verification'
-
-    # Verification for hosted Mail.ru email
-    # https://help.mail.ru/biz/domain/verification_settings/other/confirm
-    elif (record.lower().startswith('mailru-domain:')):
-        identifier = 'mailru-domain'
-
-    # Tied to some mail.ru email service, could not find more information in English
-    # https://www.youtube.com/watch?v=GHy8aH08QNo
-    elif (record.lower().startswith('wmail-verification:')):
-        identifier = 'wmail-verification'
-
-    # Hosted email through Zoho
-    # https://www.zoho.com/mail/help/adminconsole/domain-verification.html
-    elif (record.lower().startswith('zoho-verification=')):
-        identifier = 'zoho-verification'
-
-    # SendInBlue email marketing service
-    # https://help.sendinblue.com/hc/en-us/articles/208836149-Step-3-Creating-a-new-sender
-    elif (record.lower().startswith('sendinblue-code:')):
-        identifier = 'sendinblue-code'
-
-    ### END Email SaaS Verification ###
-
-    ### SaaS Service Verification ###
-
-    # Facebook provided collaboration service similar to Slack
-    # https://fb.facebook.com/help/work/431877453687567/
-    elif (record.lower().startswith('workplace-domain-verification=')):
-        identifier = 'workplace-domain-verification'
-
-    # Have I Been Pwned only allows searches against compromised email lists if you own the
-    # domain in question
-    # https://haveibeenpwned.com/DomainSearch
-    elif (record.lower().startswith('have-i-been-pwned-verification=')):
-        identifier = 'have-i-been-pwned-verification'
-
-    # Domain uses GoToMeeting with Single Sign-on through AD
-    # https://support.citrixonline.com/en_US/Webinar/all_files/G2W710101
-    elif (record.lower().startswith('citrix-verification-code=')):
-        identifier = 'citrix-verification-code'
-
-    # Domain uses the StatusPage outage communication / tracking tool
-    # https://help.statuspage.io/knowledge_base/topics/domain-ownership
-    elif (record.lower().startswith('status-page-domain-verification=')):
-        identifier = 'status-page-domain-verification'
-
-    # Domain uses Bugcrowd for identity verification and has enabled SAML based SSO
-    # for their account
-    # https://docs.bugcrowd.com/v1.0/docs/single-sign-on
-    elif (record.lower().startswith('bugcrowd-verification=')):
-        identifier = 'bugcrowd-verification'
-
-    # Domain owner has included domain in Keybase's identify proof using
-    # the "keybase prove dns" option
-    # https://keybase.io/docs/command_line
-    elif (record.lower().startswith('keybase-site-verification=')):
-        identifier = 'keybase-site-verification'
-
-    # Domain uses Wrike for project management
-    # Could not find a specific reference to what this record is used to verify
-    elif (record.lower().startswith('wrike-verification=')):
-        identifier = 'wrike-verification'
-
-    # Domain uses Sage Intacct to manage financial data
-    # Could not find specific example of what this record is used to verify
-    elif (record.lower().startswith('intacct-esk=')):
-        identifier = 'intacct-esk'
-
-    # Domain uses a Facebook verified page for their business
-    # https://developers.facebook.com/docs/sharing/domain-verification
-    elif (record.lower().startswith('facebook-domain-verification=')):
-        identifier = 'facebook-domain-verification'
-
-    ### END SaaS Service Verification ###
-
-    ### Advertising Services ###
-
-    # Brave Browser account verification; used to sign a domain up to recieve bitcoin payments
-    # from Brave in exchange for the Brave browser blocking their advertisements 
-    # https://github.com/brave-intl/publishers/blob/master/app/services/publisher_dns_record_generator.rb
-    # https://brave.com/faq/#brave-payments
-    elif (record.lower().startswith('brave-ledger-verification')):
-        identifier = 'brave-ledger-verification'
-
-    ### END Advertising Services ###
-
-    ### Developer Tools / Infrastructure ###
-
-    # Loader.io service for automated testing of API Endpoints
-    # http://support.loader.io/article/20-verifying-an-app
-    elif (record.lower().startswith('loaderio=')):
-        identifier = 'loaderio'
-
-    # Domain uses the DocuSign electronic signature service
-    # https://www.docusign.com/supportdocs/ndse-admin-guide/Content/domains.htm
-    elif (record.lower().startswith('docusign=')):
-        identifier = 'docusign'
-
-    # Domain uses the Adobe Sign service to electronically sign documents
-    # https://helpx.adobe.com/sign/help/domain_claiming.html
-    elif (record.lower().startswith('adobe-sign-verification=')):
-        identifier = 'adobe-sign-verification'
-
-    # Application is hosted using Firebase
-    # https://firebase.google.com/docs/hosting/custom-domain
-    elif (record.lower().startswith('firebase=')):
-        identifier = 'firebase'
-
-    # Blitz load testing SaaS
-    # https://www.blitz.io/
-    elif (record.lower().startswith('blitz=')):
-        identifier = 'blitz'
-
-    # Domain uses Detectify to scan for vulnerabilties
-    # https://support.detectify.com/customer/en/portal/articles/2836806-verification-with-dns-txt-
-    elif (record.lower().startswith('detectify-verification=')):
-        identifier = 'detectify-verification'
-
-    # Domain uses Tinfoil Security services to scan domain for vulnerabilities
-    # https://www.tinfoilsecurity.com/privacy
-    elif (record.lower().startswith('tinfoil-site-verification:')):
-        identifier = 'tinfoil-site-verification'
-
-    # Domain uses the Adobe provided SAML2 Identity Provider service
-    # https://helpx.adobe.com/enterprise/help/verify-domain-ownership.html
-    elif (record.lower().startswith('adobe-idp-site-verification')):
-        identifier = 'adobe-idp-site-verification'
-
-    # Domain verification for Sophos Email gateway service
-    # https://community.sophos.com/kb/en-us/124401
-    # https://community.sophos.com/kb/en-us/124703
-    elif (record.lower().startswith('sophos-domain-verification=')):
-        identifier = 'sophos-domain-verification'
-
-    # Domain verification for Dropbox Business
-    # https://www.dropbox.com/help/business/domain-verification-invite-enforcement
-    elif (record.lower().startswith('dropbox-domain-verification=')):
-        identifier = 'dropbox-domain-verification'
-
-    # Domain uses Atlassian Cloud services (Confluence Wiki)
-    # https://confluence.atlassian.com/cloud/domain-verification-873871234.html
-    elif (record.lower().startswith('atlassian-domain-verification=')):
-        identifier = 'atlassian-domain-verification'
-
-    # Domain uses Cisco Webex conferencing
-    # https://help.webex.com/docs/DOC-4860
-    elif ((record.lower().startswith('cisco-ci-domain-verification=')) or
-            (record.lower().startswith('ciscocidomainverification='))):
-        identifier = 'cisco-ci-domain-verification'
-
-    # Domain uses LogMeIn with ADFS for Single Sign-on
-    # https://secure.logmein.com/welcome/webhelp/EN/CentralUserGuide/LogMeIn/Using_ADFS_LogMeIn_Central.html
-    elif (record.lower().startswith('logmein-domain-confirmation')):
-        identifier = 'logmein-domain-confirmation'
-    
-    # Domain uses the CloudBees Jenkins build service with SSO enabled
-    # https://docs.secureauth.com/display/CAD/Cloudbees
-    elif (record.lower().startswith('cloudbees-domain-verification:')):
-        identifier = 'cloudbees-domain-verification'
-
-    # Domain uses Moxtra for collaboration with SSO enabled
-    # https://support.bitium.com/administration/saml-moxtra/
-    elif (record.lower().startswith('moxtra-site-verification=')):
-        identifier = 'moxtra-site-verification'
-
-    # Domain hosts videos on Dailymotion and has verified ownership so it can monitize them
-    # https://faq.dailymotion.com/hc/en-us/articles/211458338-Verification-Methods
-    elif (record.lower().startswith('dailymotion-domain-verification=')):
-        identifier = 'dailymotion-domain-verification'
-
-    # Domain uses Botify to crawl their websites (SEO)
-    # https://www.botify.com/support/site-validation/
-    elif (record.lower().startswith('botify-site-verification=')):
-        identifier = 'botify-site-verification'
-
-    # Domain has a custom API documentation domain in Postman
-    # https://www.getpostman.com/docs/postman/api_documentation/adding_and_verifying_custom_domains
-    elif (record.lower().startswith('postman-domain-verification=')):
-        identifier = 'postman-domain-verification'
-
-    # Perhaps related to Intermedia AppID (SSO), can't find any definite information
-    # https://www.intermedia.net/products/appid
-    elif (record.lower().startswith('appid=')):
-        identifier = 'appid'
-
-    # Domain uses Favro for workflow management and OneLogin SSO
-    # https://help.favro.com/configure-favro/enterprise/single-sign-on-setup-with-onelogin
-    elif (record.lower().startswith('favro-verification=')):
-        identifier = 'favro-verification'
-
-    # Domain is integrated with the LINE Works platform
-    # https://developers.worksmobile.com/jp/document/3012006
-    elif (record.lower().startswith('worksmobile-certification=')):
-        identifier = 'worksmobile-certification'
-
-    # Proof of domain ownership to use Cloudpiercer security scanning tool
-    # https://cloudpiercer.org/
-    elif (record.lower().startswith('cloudpiercer-verification=')):
-        identifier = 'cloudpiercer-verification'
-
-    # Perhaps related to Spycloud security system
-    # https://spycloud.com
-    elif (record.lower().startswith('spycloud-domain-verification=')):
-        identifier = 'spycloud-domain-verification'
-
-    # Domain uses (or has used) the Cisco Threat Awareness scanner tool
-    # https://supportforums.cisco.com/t5/security-documents/cisco-threat-awareness-service-frequently-asked-questions/ta-p/3159415
-    elif (record.lower().startswith('cisco-site-verification=')):
-        identifier = 'cisco-site-verification'
-
-    # Most likely used in verification of domain ownership for Thousandeyes monitoring solution
-    elif (record.lower().startswith('thousandeyes:')):
-        identifier = 'thousandeyes'
-
-    # Domain uses the OpenVoice audio conferencing product from LogMeIn
-    elif (record.lower().startswith('logmein-verification-code=')):
-        identifier='logmein-openvoice'
-
-    # Registers domain to work with the cloudControl platform for hosting
-    # https://github.com/castle/cloudcontrol-documentation/blob/master/Add-on%20Documentation/Deployment/Alias.md
-    elif (record.lower().startswith('cloudcontrol-verification:')):
-        identifier = 'cloudcontrol'
-
-    ### END Developer Tools / Infrastructure ###
-
-    ### SSL Certificates ###
-
-    # GoDaddy SSL Certificate Domain Verification
-    # https://www.godaddy.com/community/SSL-And-Security/SSL-Domain-Verification-with-DNS/m-p/42641#M378
-    elif (record.lower().startswith('dzc=')):
-        identifier = 'dzc'
-
-    # Domain verification for GlobalSign SSL Certificates service
-    # https://support.globalsign.com/customer/portal/articles/2167245-performing-domain-verification---dns-txt-record
-    elif (record.lower().startswith('globalsign-domain-verification') or
-            record.lower().startswith('_globalsign-domain-verification=')):
-        identifier = 'globalsign-domain-verification'
-
-    ### END SSL Certificates ###
-
-    #### END Domain Verification ####
-
-    #### Service Location ####
-
-    # Location of Fuse ESB message routing service
-    # https://developers.redhat.com/products/fuse/overview/?referrer=jbd
-    elif (record.lower().startswith('fuseserver=')):
-        identifier = 'fuseserver'
-
-    # Domain uses Symantec Mobile Management to identify / protect mobile devices on
-    # their network. This is the iOS agent string to find the enrollment server.
-    # https://support.symantec.com/en_US/article.HOWTO77270.html
-    elif ((record.lower().startswith('osiagentregurl=')) or
-            (record.lower().startswith('android-mdm-enroll='))):
-        identifier = 'symantec-mdm'
-
-    # Domain is using Ivanti Landesk for managing mobile devices
-    # https://help.ivanti.com/ld/help/en_US/LDMS/10.0/Mobility/mobl-DNS.htm
-    elif ((record.lower().startswith('ios-enroll=')) or
-            (record.lower().startswith('android-enroll='))):
-        identifier = 'ivanti-landesk'
-
-    # Bittorrent Tracker Preferences
-    # http://www.bittorrent.org/beps/bep_0034.html
-    elif (record.lower().startswith('bittorrent')):
-        identifier = 'bittorrent'
-
-    #### END Service Location ####
-
-    ##### More General / Tail Matches #####
-
-    # Catch-all identifier for patterns with no documented use case, probably fragments of
-    # another documented use case
-    elif ((record.lower().startswith('as=')) or
-           (record.lower().startswith('i=')) or
-           (record.lower().startswith('www=')) or
-           (record.lower().startswith('v=')) or
-           (record.lower().startswith('t=')) or
-           (record.lower().startswith("p=")) or
-           (record.lower().startswith('bio=')) # https://twitter.com/peterkarsai/status/520200572428095488
-           ):
-        identifier = 'no-documented-case'
-
-    # I have no idea what these are for, no documentation on digicert's public site
-    elif ('digicert order #' in record):
-        identifier = 'digicert'
-
-    elif (re.match('^\d\|[09a-z.-]+$', record)):
-        identifier = 'numbered-urls'
-
-    # Regex match for hex that is also not an integer string
-    elif ((re.match('^[0-9a-f]+$', record)) and not (re.match('^[0-9]+$', record))):
-        identifier = 'hexadecimal'
-
-    # Regex match for just integer strings
-    elif ((re.match('^[0-9]+$', record))):
-        identifier = 'numeric'
-    
-    # Regex match for base64 encoded data
-    # Possibly Exchange Federation keys
-    # http://www.expta.com/2011/07/how-to-configure-exchange-2010-sp1.html
-    # https://technet.microsoft.com/en-us/library/dd335047.aspx
-    elif ((record.endswith('==')) or (record.endswith('='))):
-        identifier = 'base64'
-
-    # If we get here, nothing else has matched
-    else:
-        identifier = 'unknown'
-
-    return identifier
+    def __init__(self, maxsize=CLASSIFICATION_CACHE_SIZE, registry=RULE_REGISTRY):
+        self.maxsize = maxsize
+        self.registry = registry
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, record):
+        record = record.replace('"', '')
+
+        try:
+            identifier = self.entries.pop(record)
+            self.hits += 1
+        except KeyError:
+            identifier = self.registry.classify(record)
+            self.misses += 1
+
+        if self.maxsize > 0:
+            self.entries[record] = identifier
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return identifier
+
+    # Adds (record, identifier) pairs, e.g. entries computed by a worker process
+    def update(self, entries):
+        for (record, identifier) in entries:
+            self.entries.pop(record, None)
+            self.entries[record] = identifier
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def items(self):
+        return list(self.entries.items())
+
+    # The n most recently used entries, oldest first
+    def recent(self, n):
+        entries = []
+        for record in reversed(self.entries):
+            if len(entries) >= n:
+                break
+            entries.append((record, self.entries[record]))
+        entries.reverse()
+        return entries
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return (float(self.hits) / lookups) if lookups else 0.0
+
+    def stats(self):
+        return "{} hits, {} misses ({:.1f}% hit rate), {} of {} entries used".format(
+                self.hits, self.misses, self.hitRate() * 100, len(self.entries), self.maxsize)
+
+    # Loads a cache written by save(); returns False if the file is missing or stale
+    def load(self, path):
+        if not os.path.isfile(path):
+            return False
+
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        if data.get('fingerprint') != self.registry.fingerprint:
+            sys.stderr.write("Ignoring {}; classifier rules have changed\n".format(path))
+            return False
+
+        self.update((decodeCacheKey(record), str(identifier)) for (record, identifier) in data['entries'])
+        return True
+
+    def save(self, path):
+        entries = [(encodeCacheKey(record), identifier) for (record, identifier) in self.items()]
+        data = {'fingerprint': self.registry.fingerprint, 'entries': entries}
+        with open(path, 'w') as f:
+            f.write("{}\n".format(json.dumps(data)))
+
+
+# Given a domain name, returns the first 63 bits of its md5 digest as a non-negative integer.
+# Names are hashed exactly as given, so callers must agree on case and trailing dots; unicode
+# names (from the JSON and avro readers) are hashed as their UTF-8 bytes, like the CSV names.
+def domainHash(domain):
+    if not isinstance(domain, bytes):
+        domain = domain.encode('utf-8')
+    return struct.unpack('>Q', hashlib.md5(domain).digest()[:8])[0] >> 1
+
+
+# Stand-in for array.array('l') where C long is 32 bits, since Python 2's array module has
+# no 64-bit typecode. The values are packed natively into a bytearray, so tofile, fromfile
+# and byteswap give the same bytes as a 64-bit array would.
+class HashArray(object):
+
+    def __init__(self, values=()):
+        self.data = bytearray()
+        for value in values:
+            self.append(value)
+
+    def append(self, value):
+        self.data += DOMAIN_HASH_STRUCT.pack(value)
+
+    def __len__(self):
+        return len(self.data) // DOMAIN_HASH_STRUCT.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not (0 <= i < len(self)):
+            raise IndexError(i)
+        return DOMAIN_HASH_STRUCT.unpack_from(self.data, i * DOMAIN_HASH_STRUCT.size)[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def byteswap(self):
+        size = DOMAIN_HASH_STRUCT.size
+        for i in range(0, len(self.data), size):
+            self.data[i:i + size] = self.data[i:i + size][::-1]
+
+    def tofile(self, f):
+        f.write(bytes(self.data))
+
+    def fromfile(self, f, n):
+        data = f.read(n * DOMAIN_HASH_STRUCT.size)
+        self.data += data
+        if len(data) < n * DOMAIN_HASH_STRUCT.size:
+            raise EOFError("read() didn't return enough bytes")
+
+
+# Returns an array of 64-bit domain hashes: an array.array where C long is 64 bits, and a
+# HashArray elsewhere
+def hashArray(values=()):
+    if array.array('l').itemsize >= 8:
+        return array.array('l', values)
+    return HashArray(values)
+
+
+# A set of domain names held as a sorted array of unique 63-bit hashes, 8 bytes per domain.
+# Built from a stream of names in sorted chunks that are merged once at the end; membership
+# is a binary search. index() returns a domain's position, so callers can keep per-domain
+# flags in a bytearray of len(set).
+class DomainHashSet(object):
+
+    def __init__(self, domains=(), chunk_size=DOMAIN_HASH_CHUNK):
+        chunks = []
+        chunk = set()
+        for domain in domains:
+            chunk.add(domainHash(domain))
+            if (len(chunk) >= chunk_size):
+                chunks.append(hashArray(sorted(chunk)))
+                chunk = set()
+
+        if chunk:
+            chunks.append(hashArray(sorted(chunk)))
+
+        self.hashes = hashArray()
+        last = None
+        for value in heapq.merge(*chunks):
+            if value != last:
+                self.hashes.append(value)
+                last = value
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, domain):
+        return self.index(domain) is not None
+
+    # Returns the position of the domain's hash in the set, or None if it isn't present
+    def index(self, domain):
+        value = domainHash(domain)
+        position = bisect.bisect_left(self.hashes, value)
+        if (position < len(self.hashes) and self.hashes[position] == value):
+            return position
+        return None
@@ -1,54 +1,78 @@
 #!/usr/bin/env python
+# domain-record-format.py: Reduces the ranked ActiveDNS JSON from activedns-rank-json.py to
+#   the records of the top ranked rrsets, written as "domain rrdata" lines for classify.py.
+#   MX records seen before the quota fills go to a separate -mx.txt file. The input can be
+#   plain or block-compressed (activedns-rank-json.py --compress); with --min-rank and
+#   --max-rank only the blocks covering the rank range are read.
 
+import argparse
 import json
 import sys
 import re
 
-top10kdomains = '/Users/aportier/git/txt-research/top-10k-txt-domains.txt'
+from activedns import *
 
-unique_rrsets = 10000
-infile = sys.argv[1]
-outfile = '{}.txt'.format(re.search('(.+)\.json', infile).group(1))
-mxfile = '{}-mx.txt'.format(re.search('(.+)\.json', infile).group(1))
+QTYPES = {'TXT': QTYPE_TXT, 'MX': QTYPE_MX}
 
-records = []
-rrsets = []
 
-mxrecords = []
+# Accepts a qtype by name (TXT) or number (16)
+def parseQtype(qtype):
+    if qtype.upper() in QTYPES:
+        return QTYPES[qtype.upper()]
+    return int(qtype)
 
-topdomains = []
 
-with open(top10kdomains, 'r') as o:
-    for line in o.readlines():
-        line = line.strip()
-        topdomains.append(line)
+def main():
+    parser = argparse.ArgumentParser(description="Select the records of the top ranked rrsets from a ranked ActiveDNS JSON file")
+    parser.add_argument('input', type=str)
+    parser.add_argument('--output', type=str, help="Record list to write (default <input>.txt)")
+    parser.add_argument('--mx-output', type=str, help="MX record list to write (default <input>-mx.txt)")
+    parser.add_argument('--unique-rrsets', type=int, default=UNIQUE_RRSETS, help="Number of top ranked rrsets to keep")
+    parser.add_argument('--qtype', type=parseQtype, action='append', help="qtype of the rrsets to keep, by name or number (repeatable, default TXT)")
+    parser.add_argument('--no-mx', action='store_true', help="Don't write the MX record list")
+    parser.add_argument('--min-rank', type=int, help="Only select from records ranked at least this")
+    parser.add_argument('--max-rank', type=int, help="Only select from records ranked at most this")
+    parser.add_argument('--json-backend', type=str, choices=JSON_BACKENDS, default='json', help="Module used to decode the JSON records")
+    args = parser.parse_args()
 
-with open(infile, 'r') as f:
-    for line in f.readlines():
-        line = line.strip()
-        record = json.loads(line)
-        qname = record['qname']
-        rdata = record['rdata']
-        qtype = record['qtype']
+    base = re.search('(.+)\.json', args.input).group(1)
+    outfile = args.output if args.output else '{}.txt'.format(base)
+    mxfile = args.mx_output if args.mx_output else '{}-mx.txt'.format(base)
+    qtypes = set(args.qtype if args.qtype else [QTYPE_TXT])
+    passthrough = set() if args.no_mx else set([QTYPE_MX]) - qtypes
 
-        if (len(rrsets) < unique_rrsets):
-        #if (qname in topdomains):
+    loads = jsonDecoder(args.json_backend)
 
-            if qtype == 16:
-                records.append('{} {}'.format(qname, rdata))
-                if qname not in rrsets:
-                    rrsets.append(qname)
+    # Records of the other types are skipped before they are decoded
+    wanted = set(str(qtype) for qtype in qtypes | passthrough)
+    keep = rawFieldFilter('qtype', wanted.__contains__)
 
-            elif qtype == 15:
-                mxrecords.append('{} {}'.format(qname, rdata))
+    if args.min_rank is not None or args.max_rank is not None:
+        low = args.min_rank if args.min_rank is not None else 0
+        high = args.max_rank if args.max_rank is not None else sys.maxsize
+        ranked = readRankRange(args.input, low, high, keep, loads)
+    else:
+        ranked = readJsonFile(args.input, keep, loads)
 
+    records = 0
+    rrsets = set()
+    mx_f = open(mxfile, 'w') if passthrough else None
 
-sys.stdout.write("Found {} records across {} unique rrsets\n".format(len(records), len(rrsets)))
+    with open(outfile, 'w') as o:
+        for record in selectTopRrsets(ranked, args.unique_rrsets, qtypes, passthrough):
+            line = '{} {}\n'.format(record['qname'], record['rdata'])
 
-with open(outfile, 'w') as o:
-    for record in records:
-        o.write('{}\n'.format(record))
+            if record['qtype'] in qtypes:
+                o.write(line)
+                rrsets.add((record['qname'], record['qtype']))
+                records += 1
+            else:
+                mx_f.write(line)
 
-with open(mxfile, 'w') as o:
-    for record in mxrecords:
-        o.write('{}\n'.format(record))
+    if mx_f is not None:
+        mx_f.close()
+
+    sys.stdout.write("Found {} records across {} unique rrsets\n".format(records, len(rrsets)))
+
+
+if __name__ == '__main__': main()
@@ -5,7 +5,9 @@
 #   per line) and outputs a list of the rrsets in "domain rrdata" format
 #   INPUT: Text file list of rrsets with at least 1 TXT record, one rrset per line
 #   OUTPUT: Text file list of records, one record per line, in "domain rrdata" format
+#   Progress is journaled to <output>.journal; rerunning an interrupted run resumes it.
 
+import os
 import sys
 import json
 import argparse
@@ -13,49 +15,51 @@ from dns.resolver import *
 
 from dns_audit import *
 
-LOCAL_RESOLVER = dns.resolver.Resolver()
 LOCAL_DNS_ADDR = ['127.0.0.1']
 LOCAL_DNS_PORT = 53
 ERROR_FILE = 'error.log'
 
 
-def parseRecord(record, report_file):
-
-    try:
-    	answers = lookupTxtRecord(record, LOCAL_RESOLVER)
-
-        if (len(answers) > 0):
-            for answer in answers:
-                record_answer = '{} {}'.format(record, answer)
-            with open(report_file, 'a+') as f:
-		f.write("{}\n".format(record_answer))            
-
-    except Exception:
-        with open(ERROR_FILE, 'a+') as f:
-            f.write("{}\n".format(record))
-        f.close()
-
-
 def main():
-    records = []
-
     parser = argparse.ArgumentParser(description="Given a list of rrsets containing at least one TXT record, generates a list of all records")
     parser.add_argument('input', type=str)
     parser.add_argument('output', type=str)
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS, help="Number of queries kept in flight")
+    parser.add_argument('--qps', type=int, default=FETCH_QPS, help="Maximum queries per second (0 for no limit)")
+    parser.add_argument('--max-tries', type=int, default=NO_NAMESERVER_MAX_TRIES, help="Attempts per name on SERVFAIL before giving up")
+    parser.add_argument('--retry-delay', type=float, default=NO_NAMESERVER_TIMEOUT, help="Base delay in seconds before the first retry")
+    parser.add_argument('--journal', type=str, help="Progress journal (default <output>.journal)")
+    parser.add_argument('--restart', action='store_true', help="Ignore the journal of an interrupted run and start over")
     args = parser.parse_args()
     records_file = args.input
     report_file = args.output
+    journal_file = args.journal if args.journal else '{}.journal'.format(report_file)
+
+    if args.restart and os.path.isfile(journal_file):
+        os.remove(journal_file)
+
+    journal = FetchJournal(journal_file, records_file)
+    out_f = journal.openOutput(report_file)
+    err_f = journal.openOutput(ERROR_FILE, append=True)
+    if journal.resuming:
+        sys.stdout.write("Resuming {} from byte {}\n".format(records_file, journal.offset))
 
-    with open(records_file, 'rb') as f:
-        records = f.readlines()
-    f.close()
-    records = [x.rstrip() for x in records]
+    retry = RetryScheduler(args.max_tries, args.retry_delay)
+    fetcher = TxtFetcher(LOCAL_DNS_ADDR, LOCAL_DNS_PORT, args.workers, args.qps, retry)
+
+    for (record, answers, error) in fetcher.run(journal.readNames()):
+        if error is not None:
+            err_f.write("{}\n".format(record))
+        else:
+            for answer in answers:
+                out_f.write("{} {}\n".format(record, answer))
+        journal.complete(record)
 
-    LOCAL_RESOLVER.nameservers = LOCAL_DNS_ADDR
-    LOCAL_RESOLVER.port = LOCAL_DNS_PORT
+    journal.finish()
 
-    for record in records:
-        parseRecord(record, report_file)
+    sys.stdout.write("Retried {} rrsets, gave up on {}\n".format(len(retry.attempts), len(retry.given_up)))
+    for record in retry.given_up:
+        sys.stdout.write("{} {} tries\n".format(record, retry.attempts[record]))
 
 
 if __name__ == '__main__': main()
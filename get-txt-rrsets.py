@@ -5,9 +5,12 @@
 #   rrsets that contain at least one TXT record
 #   INPUT: Text file list of rrsets, one rrset per line
 #   OUTPUT: Text file list of rrsets with at least 1 TXT record, one rrset per line
+#   Progress is journaled to <output>.journal; rerunning an interrupted run resumes it.
 
+import os
 import sys
 import time
+import argparse
 from dns.resolver import *
 
 from dns_audit import *
@@ -20,7 +23,7 @@ REPORT_FILE = 'report.txt'
 ERROR_FILE = 'error.log'
 
 
-def parseRecord(record, out_f):
+def parseRecord(record, out_f, err_f):
 
     queries = 0
     max_queries = 10
@@ -46,29 +49,36 @@ def parseRecord(record, out_f):
             starttime = time.time()
 
     except Exception as e:
-        with open(ERROR_FILE, 'w') as f:
-            f.write("{}\n".format(record)) 
+        err_f.write("{}\n".format(record))
 
 
 def main():
     parser = argparse.ArgumentParser(description="Given a list of DNS rrsets, produces a list of rrsets with at least 1 TXT record")
     parser.add_argument('input', type=str)
     parser.add_argument('output', type=str)
+    parser.add_argument('--journal', type=str, help="Progress journal (default <output>.journal)")
+    parser.add_argument('--restart', action='store_true', help="Ignore the journal of an interrupted run and start over")
     args = parser.parse_args()
     records_file = args.input
     REPORT_FILE = args.output
+    journal_file = args.journal if args.journal else '{}.journal'.format(REPORT_FILE)
 
-    in_f = open(records_file, 'rb')
-    out_f = open(REPORT_FILE, 'w')
+    if args.restart and os.path.isfile(journal_file):
+        os.remove(journal_file)
+
+    journal = FetchJournal(journal_file, records_file)
+    out_f = journal.openOutput(REPORT_FILE)
+    err_f = journal.openOutput(ERROR_FILE, append=True)
+    if journal.resuming:
+        sys.stdout.write("Resuming {} from byte {}\n".format(records_file, journal.offset))
 
     LOCAL_RESOLVER.nameservers = LOCAL_DNS_ADDR
     LOCAL_RESOLVER.port = LOCAL_DNS_PORT
 
-    for line in in_f:
-        record = line.rstrip()
-        parseRecord(record, out_f)
+    for record in journal.readNames():
+        parseRecord(record, out_f, err_f)
+        journal.complete(record)
 
-    in_f.close()
-    out_f.close()
+    journal.finish()
 
 if __name__ == '__main__': main()
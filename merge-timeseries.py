@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 # Author: Adam Portier <aporti01@villanova.edu>
 # Date: November 7, 2017
-# diff-results.py: Simple script to identify all the differences between 2 classified json
-#   data sets
+# merge-timeseries.py: Builds a per-domain timeseries of classified data sets. Each
+#   *-class.json sample is ingested once into a SQLite store (timeseries.py), which can then
+#   be queried by domain or date, or exported as the merged.json nested dict
 
 
 import sys
@@ -10,64 +11,102 @@ import glob
 import os
 import re
 import json
-import pprint
+import argparse
 
+from timeseries import *
 
-def parseFile(infile):
-    data = json.load(open(infile))
-    return_data = {}
-    for rtype in data.keys():
-        for record in data[rtype]['records']:
-            parts = record.split()
-            domain = parts[0]
-            rrdata = ' '.join(parts[1:])
 
-            try:
-                return_data[domain][rtype]['count'] += 1
-                return_data[domain][rtype]['records'].append(rrdata)
-            except KeyError:
+# Given a list of classified result sets, ingests those not already in the store in date order
+def ingestFiles(store, filelist, date=None):
+    for infile in sorted(filelist, key=lambda path: date if date else sampleDate(path)):
+        sampledate = date if date else sampleDate(infile)
+        if store.ingest(infile, sampledate):
+            sys.stdout.write("Processing capture for {}\n".format(sampledate))
+        else:
+            sys.stdout.write("Skipping capture for {}, already ingested\n".format(sampledate))
 
-                if domain not in return_data.keys():
-                    return_data[domain] = {}
-                
-                return_data[domain][rtype] = {'count': 1, 'records': [rrdata]}
 
-    return return_data
+def ingest(store, args):
+    filelist = args.input if args.input else glob.glob(os.getcwd() + "/*-class.json")
+    if args.date and len(filelist) != 1:
+        sys.stderr.write("--date needs exactly one input\n")
+        sys.exit(1)
+    ingestFiles(store, filelist, args.date)
 
 
-def main():
-    
-    merged_results = {}
+def history(store, args):
+    sys.stdout.write("{}\n".format(json.dumps(store.history(args.domain), indent=4, sort_keys=True)))
+
+
+def changed(store, args):
+    for (domain, before, after) in store.changed(args.date):
+        sys.stdout.write("{} [{}] -> [{}]\n".format(domain, before, after))
+
+
+def view(store, args):
+    with open(args.output, 'w') as f:
+        f.write("{}\n".format(json.dumps(store.view(args.date), indent=4, sort_keys=True)))
+
 
-    output_file = 'merged.json'
+def stats(store, args):
+    (intervals, samples) = store.stats()
+    sys.stdout.write("Samples: {}\n".format(len(store.dates())))
+    sys.stdout.write("Intervals stored: {}\n".format(intervals))
+    sys.stdout.write("Record sets they cover: {}\n".format(samples))
 
-    filelist = glob.glob(os.getcwd() + "/*-class.json")
-    filelist.sort()
 
-    for infile in filelist:
-        sampledate = re.search('activedns\-([0-9]+)\-class.json', infile).group(1)
-        sys.stdout.write("Processing capture for {}\n".format(sampledate))
-        sample_data = parseFile(infile)
+def export(store, args):
+    with open(args.output, 'w') as f:
+        store.exportMerged(f)
+
+
+# The original behaviour: ingest every *-class.json in the current directory and write merged.json
+def merge(store, args):
+    ingestFiles(store, glob.glob(os.getcwd() + "/*-class.json"))
+    with open('merged.json', 'w') as f:
+        store.exportMerged(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain a per-domain timeseries of classified data sets")
+    parser.add_argument('--db', type=str, default='timeseries.db', help="SQLite timeseries store")
+    subparsers = parser.add_subparsers()
+
+    ingest_parser = subparsers.add_parser('ingest', help="Add classified result sets (default: *-class.json in the current directory)")
+    ingest_parser.add_argument('input', type=str, nargs='*')
+    ingest_parser.add_argument('--date', type=str, help="Sample date, if it isn't in the input's name")
+    ingest_parser.set_defaults(func=ingest)
 
-        for domain in sample_data.keys():
+    history_parser = subparsers.add_parser('history', help="Print every sample of a domain")
+    history_parser.add_argument('domain', type=str)
+    history_parser.set_defaults(func=history)
 
-            if domain not in merged_results.keys():
-                merged_results[domain] = {}
+    changed_parser = subparsers.add_parser('changed', help="List the domains whose class set changed on a date")
+    changed_parser.add_argument('date', type=str)
+    changed_parser.set_defaults(func=changed)
 
+    view_parser = subparsers.add_parser('view', help="Rebuild the classified result set of one sample date")
+    view_parser.add_argument('date', type=str)
+    view_parser.add_argument('output', type=str)
+    view_parser.set_defaults(func=view)
 
-            for rtype in sample_data[domain].keys():
-                if rtype not in merged_results[domain].keys():
-                    merged_results[domain][rtype] = {}
+    stats_parser = subparsers.add_parser('stats', help="Show how many intervals the store holds")
+    stats_parser.set_defaults(func=stats)
 
-                merged_results[domain][rtype][sampledate] = sample_data[domain][rtype]
+    export_parser = subparsers.add_parser('export', help="Write the store as a merged.json nested dict")
+    export_parser.add_argument('output', type=str, nargs='?', default='merged.json')
+    export_parser.set_defaults(func=export)
 
+    merge_parser = subparsers.add_parser('merge', help="Ingest *-class.json from the current directory and write merged.json")
+    merge_parser.set_defaults(func=merge)
 
-    #pp = pprint.PrettyPrinter(indent=4)
-    #pp.pprint(merged_results)
+    args = parser.parse_args(sys.argv[1:] if len(sys.argv) > 1 else ['merge'])
 
-    with open(output_file, 'w') as f:
-        f.write("{}\n".format(json.dumps(merged_results, indent=4, sort_keys=True)))
-    f.close()
+    store = TimeseriesStore(args.db)
+    try:
+        args.func(store, args)
+    finally:
+        store.close()
 
 
 
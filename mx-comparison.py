@@ -4,43 +4,73 @@ import argparse
 import json
 import re
 import sys
-import netaddr
+
+from dns_audit import *
+from snapshot import *
+
+
+# Given an MX file (domain-record-format.py's -mx.txt output), yields the domain of every line
+def readMxDomains(mxfile):
+    with open(mxfile, 'r') as f:
+        for line in f:
+            parts = line.split(None, 1)
+            if parts:
+                yield parts[0]
+
+
+def writeDomains(path, domains):
+    with open(path, 'w') as f:
+        for domain in domains:
+            f.write('{}\n'.format(domain))
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Given the JSON output of a classified result set and a list of MX records, performs some analysis of the unified set")
+    parser = argparse.ArgumentParser(description="Given the JSON output (or snapshot) of a classified result set and a list of MX records, performs some analysis of the unified set")
     parser.add_argument('input', type=str)
     parser.add_argument('mxfile', type=str)
+    parser.add_argument('--both', type=str, help="Write the domains with both SPF and MX records to this file")
+    parser.add_argument('--spf-only', type=str, help="Write the SPF domains without MX records to this file")
+    parser.add_argument('--mx-only', type=str, help="Write the MX domains without SPF records to this file")
     args = parser.parse_args()
     records_file = args.input
     mxfile = args.mxfile
-    
-    data = json.load(open(records_file))
 
-    mxdomains = []
-    spfdomains = []
+    # The MX list can be tens of millions of lines, so only a hash of each domain is kept
+    mxdomains = DomainHashSet(readMxDomains(mxfile))
 
-    with open(mxfile, 'r') as f:
-        for line in f.readlines():
-            domain = line.split()[0]
-            if domain not in mxdomains:
-                mxdomains.append(domain)
+    spfdomains = set()
+    for (domain,) in readClass(records_file, 'spf', ('domain',)):
+        spfdomains.add(domain)
 
+    spf_with_mx = sorted(domain for domain in spfdomains if domain in mxdomains)
+    spf_without_mx = sorted(domain for domain in spfdomains if domain not in mxdomains)
+    mx_without_spf = len(mxdomains) - len(spf_with_mx)
 
-    for record in data['spf']['records']:
-        domain = record.split()[0]
-        if domain not in spfdomains:
-            spfdomains.append(domain)
+    sys.stdout.write('Total MX Domains: {}\n'.format(len(mxdomains)))
+    sys.stdout.write('Total SPF Domains: {}\n'.format(len(spfdomains)))
+    sys.stdout.write('Total SPF with MX: {}\n'.format(len(spf_with_mx)))
+    sys.stdout.write('Total SPF without MX: {}\n'.format(len(spf_without_mx)))
+    sys.stdout.write('Total MX without SPF: {}\n'.format(mx_without_spf))
 
-    
-    spf_with_mx = 0
+    if args.both:
+        writeDomains(args.both, spf_with_mx)
 
-    for domain in spfdomains:
-        if domain in mxdomains:
-            spf_with_mx += 1
+    if args.spf_only:
+        writeDomains(args.spf_only, spf_without_mx)
 
-    sys.stdout.write('Total MX Domains: {}\n'.format(len(mxdomains)))
-    sys.stdout.write('Total SPF with MX: {}\n'.format(spf_with_mx))
+    # The MX-only names aren't kept in memory, so they come from a second pass over the MX
+    # file, with a flag per hashed domain so each one is written once
+    if args.mx_only:
+        written = bytearray(len(mxdomains))
+        with open(args.mx_only, 'w') as f:
+            for domain in readMxDomains(mxfile):
+                if domain in spfdomains:
+                    continue
+
+                position = mxdomains.index(domain)
+                if not written[position]:
+                    written[position] = 1
+                    f.write('{}\n'.format(domain))
 
 
 if __name__ == '__main__': main()
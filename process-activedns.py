@@ -1,39 +1,102 @@
 #!/usr/bin/env python
+# process-activedns.py: First-pass conversion of an ActiveDNS avro dump to line-delimited JSON.
+#   Only the record types of interest are kept (TXT by default, optionally MX in the same pass)
+#   and the avro files are converted in parallel, one file per worker process.
+#   INPUT: Directory of ActiveDNS *.avro files
+#   OUTPUT: Directory of <filenum>.json files, one JSON record per line (<filenum>.json.blk
+#   block-compressed files with --compress)
 
 import sys
 import glob
 import os
 import re
-import datetime
+import time
 import json
-import fastavro as avro
-
-basedir = '/home/aportier/activedns-scripts'
-topfile = basedir + '/top-1m.csv'
-outdir = basedir + '/json'
-filelist = glob.glob(os.getcwd() + "/*.avro")
-filelist.sort()
-
-for infile in filelist:
-    filenum = re.search('(\d+)\.avro', infile).group(1)
-    outfile = outdir + '/{}.json'.format(filenum)
-
-    if (os.path.isfile(outfile) == False):
-        output = open(outfile, 'w')
-        sys.stdout.write("Processing {}\n".format(infile))
-        start = datetime.datetime.now()
-        with open(infile, 'rb') as i:
-            reader = avro.reader(i)
-            schema = reader.schema
-
-            for record in reader:
-                if (record['qtype'] == 16):
-                    output.write("{}\n".format(json.dumps(record)))
-
-        output.close()
-        end = datetime.datetime.now()
-        delta = end - start
-        sys.stdout.write("Took {} seconds\n".format(delta.total_seconds()))
+import argparse
+import multiprocessing
 
+from activedns import *
+
+
+# Converts a single avro file, writing through a temporary file so an interrupted run never
+# leaves behind a partial output that would later be skipped as already processed
+def convertFile(job):
+    (infile, outfile, qtypes, codec) = job
+    start = time.time()
+    counts = {'total': 0}
+    kept = 0
+
+    # A BlockWriter writes through its own temporary file
+    tmpfile = outfile + '.tmp'
+    output = BlockWriter(outfile, codec) if codec else open(tmpfile, 'w')
+    with output:
+        for record in readAvroFile(infile, qtypes, counts):
+            writeJsonLine(output, json.dumps(record))
+            kept += 1
+
+    if not codec:
+        os.rename(tmpfile, outfile)
+    return (infile, counts['total'], kept, time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts a directory of ActiveDNS avro files into JSON, keeping only the requested record types")
+    parser.add_argument('indir', type=str, nargs='?', default=os.getcwd())
+    parser.add_argument('outdir', type=str, nargs='?', default=os.path.join(os.getcwd(), 'json'))
+    parser.add_argument('--mx', action='store_true', help="Also keep MX (qtype 15) records")
+    parser.add_argument('--qtype', type=int, action='append', dest='qtypes', help="Record type to keep (repeatable, default 16)")
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--compress', type=str, choices=COMPRESS_CODECS, help="Write block-compressed <filenum>.json.blk files")
+    args = parser.parse_args()
+
+    qtypes = set(args.qtypes if args.qtypes else [QTYPE_TXT])
+    if args.mx:
+        qtypes.add(QTYPE_MX)
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    filelist = glob.glob(os.path.join(args.indir, "*.avro"))
+    filelist.sort()
+
+    jobs = []
+    for infile in filelist:
+        filenum = re.search('(\d+)\.avro', infile).group(1)
+        outfile = os.path.join(args.outdir, '{}.json'.format(filenum))
+
+        if not (os.path.isfile(outfile) or os.path.isfile(outfile + BLOCK_SUFFIX)):
+            if args.compress:
+                outfile += BLOCK_SUFFIX
+            jobs.append((infile, outfile, qtypes, args.compress))
+        else:
+            sys.stdout.write('Skipping {}; already processed\n'.format(infile))
+
+    start = time.time()
+    total_records = 0
+    total_kept = 0
+
+    if (args.jobs > 1):
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(convertFile, jobs)
     else:
-        sys.stdout.write('Skipping {}; already processed\n'.format(infile))
+        pool = None
+        results = (convertFile(job) for job in jobs)
+
+    for (infile, total, kept, elapsed) in results:
+        total_records += total
+        total_kept += kept
+        rate = total / elapsed if elapsed > 0 else 0
+        sys.stdout.write("Processed {}: {} records, {} kept in {:.2f} seconds ({:.0f} records/sec)\n".format(
+            infile, total, kept, elapsed, rate))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    rate = total_records / elapsed if elapsed > 0 else 0
+    sys.stdout.write("Processed {} files: {} records, {} kept in {:.2f} seconds ({:.0f} records/sec)\n".format(
+        len(jobs), total_records, total_kept, elapsed, rate))
+
+
+if __name__ == '__main__': main()
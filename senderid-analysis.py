@@ -7,8 +7,10 @@ import sys
 import netaddr
 from netaddr import *
 
+from snapshot import *
+
 # Given a SenderID TXT record, performs some analysis of the contents and returns the result
-def processSenderId(record):
+def processSenderId(domain, rdata):
     senderid_stats = {
         'domain' : '',
         'pra': False,
@@ -16,9 +18,8 @@ def processSenderId(record):
         'both': False
     }
 
-    record_parts = record.split()
-    senderid_stats['domain'] = record_parts[0]
-    prefix = record_parts[1]
+    senderid_stats['domain'] = domain
+    prefix = rdata.split()[0]
     scopes = prefix.split('/')[1].split(',')
 
     if 'pra' in scopes:
@@ -35,7 +36,7 @@ def processSenderId(record):
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Given the JSON output of a classified result set, performs some metrics on SenderID records")
+    parser = argparse.ArgumentParser(description="Given the JSON output (or snapshot) of a classified result set, performs some metrics on SenderID records")
     parser.add_argument('input', type=str)
     parser.add_argument('output', type=str)
     args = parser.parse_args()
@@ -44,16 +45,15 @@ def main():
     
     headers = ['domain','pra','mfrom','both']
 
-    data = json.load(open(records_file))
     out_f = open(REPORT_FILE, 'w')
     out_f.write("{}\n".format(','.join(headers)))
 
     include_targets = {}
     top_include = []
 
-    for record in data['sender-id']['records']:
+    for (domain, rdata) in readClass(records_file, 'sender-id'):
         line = []
-        senderid_stats = processSenderId(record)
+        senderid_stats = processSenderId(domain, rdata)
         for header in headers:
             line.append(senderid_stats[header])
             
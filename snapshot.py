@@ -0,0 +1,267 @@
+# snapshot.py: Columnar storage for classified record sets. A snapshot is a directory with a
+#   manifest.json and one sub-directory per class holding a plain text file per column
+#   (domain, rdata, rank), one value per line, with the line numbers lining up across the
+#   columns. Readers open only the classes and columns they ask for.
+#
+#   readClass() also accepts the other classified outputs (the -class.json file and the
+#   classify.py --stream shard directory) so the analysis scripts work with any of them.
+#
+#   Record is the shared in-memory form of one "domain rdata" record: the line is split once
+#   when it is read, and the loaders intern domain and class names so the records of a domain
+#   and every record of a class share one string.
+
+import os
+import json
+import itertools
+
+SNAPSHOT_COLUMNS = ('domain', 'rdata', 'rank')
+MANIFEST_FILE = 'manifest.json'
+SHARD_COUNTS_FILE = 'counts.json'
+
+try:
+    izip = itertools.izip
+except AttributeError:
+    izip = zip
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+
+# Returns the interned copy of a domain or class name. Python 2's intern() only takes byte
+# strings, so names loaded from JSON are converted first; names that aren't ASCII are left
+# as they are.
+def internName(name):
+    try:
+        return intern(str(name))
+    except (TypeError, UnicodeError):
+        return name
+
+
+# Returns rdata loaded from JSON as a byte string under Python 2, where unicode text takes up
+# to four bytes per character
+def compactText(text):
+    try:
+        return str(text)
+    except UnicodeError:
+        return text.encode('utf-8')
+
+
+class Record(object):
+    __slots__ = ('domain', 'rdata')
+
+    def __init__(self, domain, rdata):
+        self.domain = domain
+        self.rdata = rdata
+
+    # The "domain rdata" form used by the JSON outputs and shards
+    def text(self):
+        return '{} {}'.format(self.domain, self.rdata)
+
+    __str__ = text
+
+    def __repr__(self):
+        return 'Record({!r}, {!r})'.format(self.domain, self.rdata)
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.domain == other.domain and self.rdata == other.rdata
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.domain, self.rdata))
+
+
+# Given a "domain rdata" line, returns its Record with the domain interned (the rdata is kept
+# exactly as written), or None for an empty line
+def recordFromText(text):
+    text = text.rstrip('\n')
+    if not text:
+        return None
+    parts = text.split(' ', 1)
+    return Record(internName(parts[0]), compactText(parts[1]) if len(parts) > 1 else '')
+
+
+class SnapshotWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.counts = {}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def open(self, rclass):
+        classdir = os.path.join(self.path, rclass)
+        if not os.path.isdir(classdir):
+            os.makedirs(classdir)
+
+        self.files[rclass] = [open(os.path.join(classdir, column), 'w') for column in SNAPSHOT_COLUMNS]
+        self.counts[rclass] = 0
+        return self.files[rclass]
+
+    # Adds one record; rank is left blank when it isn't known
+    def write(self, rclass, domain, rdata, rank=None):
+        try:
+            (domain_f, rdata_f, rank_f) = self.files[rclass]
+        except KeyError:
+            (domain_f, rdata_f, rank_f) = self.open(rclass)
+
+        domain_f.write('{}\n'.format(domain))
+        rdata_f.write('{}\n'.format(rdata))
+        rank_f.write('{}\n'.format('' if rank is None else rank))
+        self.counts[rclass] += 1
+
+    def close(self):
+        for files in self.files.values():
+            for f in files:
+                f.close()
+
+        manifest = {'columns': list(SNAPSHOT_COLUMNS), 'classes': self.counts}
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as f:
+            f.write("{}\n".format(json.dumps(manifest, indent=4, sort_keys=True)))
+
+
+# Writes a snapshot from {class: iterable of Records}
+def writeSnapshot(path, record_types):
+    writer = SnapshotWriter(path)
+    for rclass in sorted(record_types.keys()):
+        for record in record_types[rclass]:
+            writer.write(rclass, record.domain, record.rdata)
+    writer.close()
+    return writer.counts
+
+
+def isSnapshot(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def isShardDirectory(path):
+    return os.path.isfile(os.path.join(path, SHARD_COUNTS_FILE))
+
+
+# json.load of the last -class.json file read, so pulling several classes out of the same
+# file only parses it once
+LOADED_JSON = {}
+
+
+def loadClassifiedJson(path):
+    if path not in LOADED_JSON:
+        LOADED_JSON.clear()
+        with open(path, 'r') as f:
+            LOADED_JSON[path] = json.load(f)
+    return LOADED_JSON[path]
+
+
+# Returns the per-class record counts of a snapshot, shard directory or -class.json file
+def listClasses(path):
+    if isSnapshot(path):
+        with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+            return json.load(f)['classes']
+
+    if isShardDirectory(path):
+        with open(os.path.join(path, SHARD_COUNTS_FILE), 'r') as f:
+            return json.load(f)
+
+    data = loadClassifiedJson(path)
+    return dict((rclass, len(data[rclass]['records'])) for rclass in data.keys())
+
+
+# Returns the shard file of a class in a shard directory, or None if counts.json doesn't list
+# the class; a <class>.txt left over from an earlier run in the same directory isn't part of
+# the result set
+def shardFile(path, rclass):
+    if rclass not in listClasses(path):
+        return None
+
+    shard = os.path.join(path, '{}.txt'.format(rclass))
+    return shard if os.path.isfile(shard) else None
+
+
+def readColumns(path, rclass, columns):
+    files = [open(os.path.join(path, rclass, column), 'r') for column in columns]
+    try:
+        for values in izip(*files):
+            yield tuple(value[:-1] for value in values)
+    finally:
+        for f in files:
+            f.close()
+
+
+# Yields a tuple of the requested columns for every record of a class. A class that isn't
+# present yields nothing. Snapshots are read column by column; the other formats have to
+# split each "domain rdata" string.
+def readClass(path, rclass, columns=('domain', 'rdata')):
+    for column in columns:
+        if column not in SNAPSHOT_COLUMNS:
+            raise ValueError("Unknown column {}".format(column))
+
+    if isSnapshot(path):
+        if rclass in listClasses(path):
+            for values in readColumns(path, rclass, columns):
+                yield values
+        return
+
+    if isShardDirectory(path):
+        shard = shardFile(path, rclass)
+        if shard is not None:
+            with open(shard, 'r') as f:
+                for line in f:
+                    yield splitColumns(line.rstrip('\n'), columns)
+        return
+
+    data = loadClassifiedJson(path)
+    if rclass in data:
+        for record in data[rclass]['records']:
+            yield splitColumns(record, columns)
+
+
+# Yields the Records of a class of a snapshot, shard directory or -class.json file
+def readClassRecords(path, rclass):
+    if isSnapshot(path):
+        for (domain, rdata) in readClass(path, rclass):
+            yield Record(internName(domain), rdata)
+        return
+
+    if isShardDirectory(path):
+        shard = shardFile(path, rclass)
+        if shard is not None:
+            with open(shard, 'r') as f:
+                for line in f:
+                    record = recordFromText(line)
+                    if record is not None:
+                        yield record
+        return
+
+    data = loadClassifiedJson(path)
+    if rclass in data:
+        for text in data[rclass]['records']:
+            record = recordFromText(text)
+            if record is not None:
+                yield record
+
+
+# Loads every class of a result set as {class: [Record, ...]}. A -class.json file is parsed
+# without the loadClassifiedJson cache and converted one class at a time, so only one copy
+# of the records is held at once.
+def loadRecords(path):
+    if isSnapshot(path) or isShardDirectory(path):
+        return dict((internName(rclass), list(readClassRecords(path, rclass))) for rclass in listClasses(path).keys())
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    records = {}
+    for rclass in list(data.keys()):
+        records[internName(rclass)] = [record for record in (recordFromText(text) for text in data[rclass]['records']) if record is not None]
+        del data[rclass]
+    return records
+
+
+def splitColumns(record, columns):
+    parts = record.split(' ', 1)
+    values = {'domain': parts[0], 'rdata': parts[1] if len(parts) > 1 else '', 'rank': ''}
+    return tuple(values[column] for column in columns)
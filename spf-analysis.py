@@ -4,16 +4,19 @@ import argparse
 import json
 import re
 import sys
-import netaddr
-from netaddr import *
+
+from address_space import *
+from snapshot import *
+from spf_expand import *
 
 # Given an SPF TXT record, performs some analysis of the contents and returns the result
-def processSpfRecord(record):
+def processSpfRecord(domain, rdata):
     spf_stats = {
         'catch-all':'none',
         'ip4': 0,
         'ip4_addresses': 0,
         'ip6': 0,
+        'ip6_addresses': 0,
         'a': 0,
         'mx': 0,
         'ptr': 0,
@@ -24,9 +27,9 @@ def processSpfRecord(record):
     }
 
     catch_all = False
-    record_parts = record.split()
-    spf_stats['domain'] = record_parts[0]
-    for part in record_parts:
+    address_space = AddressSpace()
+    spf_stats['domain'] = domain
+    for part in rdata.split():
         # Make note of the catch-all rule
         if (part == '+all'):
             spf_stats['catch-all'] = 'pass'
@@ -47,21 +50,22 @@ def processSpfRecord(record):
         elif (part.startswith('ip4')):
             try:
                 network = re.search('ip4:(.*)', part).group(1)
-                spf_stats['ip4_addresses'] += IPNetwork(network).size
+                address_space.add(network, 4)
                 spf_stats['ip4'] += 1
-            except netaddr.core.AddrFormatError:
+            except ValueError:
                 sys.stderr.write('Error processing network {}\n'.format(network))
-            except (AttributeError, ValueError):
+            except AttributeError:
                 sys.stderr.write('Error processing ip4 directive {}\n'.format(part))
 
         elif (part.startswith('ip6')):
+            # Every ip6 directive is counted, as before ip6 networks were sized
             try:
                 network = re.search('ip6:(.*)', part).group(1)
                 spf_stats['ip6'] += 1
-        #        spf_stats['ip6_addresses'] += IPNetwork(network).size
-            except netaddr.core.AddrFormatError:
+                address_space.add(network, 6)
+            except ValueError:
                 sys.stderr.write('Error processing network {}\n'.format(network))
-            except (AttributeError, ValueError):
+            except AttributeError:
                 sys.stderr.write('Error processing ip6 directive {}\n'.format(part))
 
         elif (part.startswith('a')):
@@ -80,29 +84,83 @@ def processSpfRecord(record):
             if ('include:_spf.google.com' in part):
                 spf_stats['include-gmail'] = True
 
+    # Overlapping ip4/ip6 networks within the record are only counted once
+    spf_stats['ip4_addresses'] = address_space.size(4)
+    spf_stats['ip6_addresses'] = address_space.size(6)
+    spf_stats['address-space'] = address_space
+
     return spf_stats
 
 
+# Given the expansion of an SPF record, returns the lookup counts and the size of the address
+# space it authorizes once overlapping networks are merged
+def processExpansion(expander, expansion):
+    address_space = AddressSpace()
+    for (key, family) in (('ip4', 4), ('ip6', 6)):
+        for network in expansion[key]:
+            try:
+                address_space.add(network, family)
+            except ValueError:
+                sys.stderr.write('Error processing network {}\n'.format(network))
+
+    return {
+        'dns-lookups': expansion['lookups'],
+        'void-lookups': expansion['void-lookups'],
+        'limits-exceeded': ' '.join(expander.violations(expansion)),
+        'authorized-ip4-addresses': address_space.size(4),
+        'authorized-ip6-addresses': address_space.size(6),
+        'expand-errors': len(expansion['errors']),
+        'authorized-space': address_space
+    }
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Given the JSON output of a classified result set, performs some metrics on SPF records")
+    parser = argparse.ArgumentParser(description="Given the JSON output (or snapshot) of a classified result set, performs some metrics on SPF records")
     parser.add_argument('input', type=str)
     parser.add_argument('output', type=str)
+    parser.add_argument('--expand', action='store_true', help="Follow include, redirect, a and mx terms to count DNS lookups and authorized addresses")
+    parser.add_argument('--nameserver', type=str, action='append', help="Nameserver for --expand lookups (repeatable, default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=53)
+    parser.add_argument('--zone-file', type=str, help="Answer --expand lookups from a zone-style text file instead of DNS")
+    parser.add_argument('--workers', type=int, default=EXPAND_WORKERS, help="Records expanded concurrently")
+    parser.add_argument('--qps', type=int, default=FETCH_QPS, help="Maximum DNS queries per second, 0 for no limit")
     args = parser.parse_args()
     records_file = args.input
     REPORT_FILE = args.output
     
-    headers = ['domain','catch-all','ip4','ip4_addresses','ip6','a','mx','ptr','exist','include','include-gmail']
+    headers = ['domain','catch-all','ip4','ip4_addresses','ip6','ip6_addresses','a','mx','ptr','exist','include','include-gmail']
+
+    records = ((domain, rdata, None) for (domain, rdata) in readClass(records_file, 'spf'))
+    expander = None
+    limits = {}
+    total_space = AddressSpace()
+    authorized_space = AddressSpace()
+
+    if args.expand:
+        headers += ['dns-lookups','void-lookups','limits-exceeded','authorized-ip4-addresses','authorized-ip6-addresses','expand-errors']
+        if args.zone_file:
+            source = ZoneSource(args.zone_file)
+        else:
+            source = DnsSource(args.nameserver or ['127.0.0.1'], args.port, args.qps)
+        expander = SpfExpander(source, args.workers)
+        records = expander.run(readClass(records_file, 'spf'))
 
-    data = json.load(open(records_file))
     out_f = open(REPORT_FILE, 'w')
     out_f.write("{}\n".format(','.join(headers)))
 
     include_targets = {}
     top_include = []
 
-    for record in data['spf']['records']:
+    for (domain, rdata, expansion) in records:
         line = []
-        spf_stats = processSpfRecord(record)
+        spf_stats = processSpfRecord(domain, rdata)
+        total_space.update(spf_stats['address-space'])
+        if expansion is not None:
+            spf_stats.update(processExpansion(expander, expansion))
+            authorized_space.update(spf_stats['authorized-space'])
+            for limit in expander.violations(expansion):
+                limits[limit] = limits.get(limit, 0) + 1
+
         for header in headers:
             line.append(spf_stats[header])
             
@@ -125,6 +183,18 @@ def main():
     for target in top_include:
         sys.stdout.write("{}\n".format(target))
 
+    sys.stdout.write("----- Address Space -----\n")
+    sys.stdout.write("Distinct ip4 addresses: {}\n".format(total_space.size(4)))
+    sys.stdout.write("Distinct ip6 addresses: {}\n".format(total_space.size(6)))
+
+    if expander is not None:
+        sys.stdout.write("----- Include Expansion -----\n")
+        sys.stdout.write("Distinct authorized ip4 addresses: {}\n".format(authorized_space.size(4)))
+        sys.stdout.write("Distinct authorized ip6 addresses: {}\n".format(authorized_space.size(6)))
+        sys.stdout.write("Records over the {} lookup limit: {}\n".format(SPF_MAX_LOOKUPS, limits.get('lookup-limit', 0)))
+        sys.stdout.write("Records over the {} void lookup limit: {}\n".format(SPF_MAX_VOID_LOOKUPS, limits.get('void-lookup-limit', 0)))
+        sys.stdout.write("{}\n".format(expander.stats()))
+
     out_f.close()
 
 
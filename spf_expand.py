@@ -0,0 +1,440 @@
+# spf_expand.py: Recursive SPF evaluation for spf-analysis.py. Follows include, redirect, a
+#   and mx terms to find the address space a record actually authorizes and counts the DNS
+#   lookups each record costs against the RFC 7208 limits (10 lookups, 2 void lookups).
+#
+#   All DNS answers go through one ResolutionCache and every expanded include target is
+#   memoized, so a target shared by thousands of records (_spf.google.com) is resolved once
+#   per run. Records are expanded by a pool of threads. Answers come from a DnsSource (a
+#   recursive or stub resolver) or, for testing, a ZoneSource reading a zone-style text file.
+
+import re
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import dns.resolver
+import dns.exception
+
+from dns_audit import *
+
+SPF_MAX_LOOKUPS = 10
+SPF_MAX_VOID_LOOKUPS = 2
+SPF_MAX_MX_NAMES = 10
+
+EXPAND_WORKERS = 32
+
+SPF_VERSION = re.compile(r'^v=spf1(\s|$)', re.IGNORECASE)
+SPF_CIDR = re.compile(r'^(.*?)(?:/(\d+))?(?://(\d+))?$')
+ZONE_TXT_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+# Given a domain name, returns it lowercased with a trailing dot
+def normalizeName(name):
+    name = name.lower()
+    if not name.endswith('.'):
+        name += '.'
+    return name
+
+
+# Given TXT rdata in presentation form ("v=spf1 a" "mx -all"), returns the joined strings;
+# unquoted text is returned as it is
+def recordText(rdata):
+    strings = ZONE_TXT_STRING.findall(rdata)
+    if strings:
+        return ''.join(strings)
+    return rdata
+
+
+# Answers queries with dnspython. Each thread gets its own resolver; an optional qps cap is
+# shared by all of them.
+class DnsSource(object):
+
+    def __init__(self, nameservers=None, port=53, qps=None, timeout=5.0):
+        self.nameservers = nameservers
+        self.port = port
+        self.timeout = timeout
+        self.bucket = TokenBucket(qps) if qps else None
+        self.local = threading.local()
+
+    def resolver(self):
+        try:
+            return self.local.resolver
+        except AttributeError:
+            resolver = dns.resolver.Resolver()
+            if self.nameservers:
+                resolver.nameservers = self.nameservers
+            resolver.port = self.port
+            resolver.lifetime = self.timeout
+            self.local.resolver = resolver
+            return resolver
+
+    # Given a name and record type, returns (status, values). status is 'ok', 'void' for
+    # NXDOMAIN or an empty answer, or 'error' if the lookup failed. TXT values are the
+    # joined character strings, A/AAAA values addresses and MX values exchange names.
+    def query(self, name, rdtype):
+        if self.bucket:
+            self.bucket.acquire()
+
+        try:
+            answers = self.resolver().query(name, rdtype)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return ('void', [])
+        except (dns.resolver.NoNameservers, dns.exception.Timeout):
+            return ('error', [])
+        except dns.exception.DNSException:
+            return ('error', [])
+
+        if rdtype == 'TXT':
+            values = [''.join(rdata.strings) for rdata in answers]
+        elif rdtype == 'MX':
+            values = [normalizeName(rdata.exchange.to_text()) for rdata in answers]
+        else:
+            values = [rdata.address for rdata in answers]
+
+        return ('ok', values)
+
+
+# Answers queries from a zone-style text file with one "name [ttl] [class] type rdata" record
+# per line; ';' starts a comment. TXT rdata is one or more quoted strings, MX rdata is
+# "preference exchange". Names missing from the file are NXDOMAIN.
+class ZoneSource(object):
+
+    def __init__(self, path):
+        self.records = {}
+
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith(';'):
+                    self.add(line)
+
+    def add(self, line):
+        parts = line.split()
+        name = normalizeName(parts[0])
+
+        # Skip the optional TTL and class
+        position = 1
+        while (parts[position].isdigit() or parts[position].upper() in ('IN', 'CH', 'HS')):
+            position += 1
+
+        rdtype = parts[position].upper()
+        rdata = line.split(None, position + 1)[position + 1]
+
+        if rdtype == 'TXT':
+            value = recordText(rdata)
+        elif rdtype == 'MX':
+            value = normalizeName(rdata.split()[-1])
+        else:
+            value = rdata
+
+        self.records.setdefault((name, rdtype), []).append(value)
+
+    def query(self, name, rdtype):
+        values = self.records.get((normalizeName(name), rdtype))
+        if values:
+            return ('ok', list(values))
+        return ('void', [])
+
+
+# Thread-safe memo of (name, rdtype) -> (status, values). Concurrent requests for the same
+# key wait for the first one rather than all going to the source.
+class ResolutionCache(object):
+
+    def __init__(self, source):
+        self.source = source
+        self.answers = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.hits = 0
+
+    def query(self, name, rdtype):
+        key = (normalizeName(name), rdtype)
+
+        with self.lock:
+            if key in self.answers:
+                self.hits += 1
+                return self.answers[key]
+
+            event = self.pending.get(key)
+            if event is None:
+                event = threading.Event()
+                self.pending[key] = event
+                owner = True
+                self.queries += 1
+            else:
+                owner = False
+                self.hits += 1
+
+        if not owner:
+            event.wait()
+            return self.answers[key]
+
+        try:
+            answer = self.source.query(key[0], rdtype)
+        except Exception:
+            answer = ('error', [])
+
+        with self.lock:
+            self.answers[key] = answer
+            del self.pending[key]
+        event.set()
+        return answer
+
+    def stats(self):
+        return "{} DNS queries, {} answered from cache".format(self.queries, self.hits)
+
+
+def newExpansion():
+    return {
+        'lookups': 0,
+        'void-lookups': 0,
+        'ip4': [],
+        'ip6': [],
+        'includes': [],
+        'errors': []
+    }
+
+
+# Adds an expanded include or redirect target into the record being expanded. The target's
+# addresses only count as authorized if the term that pulled it in passes.
+def mergeExpansion(expansion, target, authorize):
+    expansion['lookups'] += target['lookups']
+    expansion['void-lookups'] += target['void-lookups']
+    expansion['includes'].extend(target['includes'])
+    expansion['errors'].extend(target['errors'])
+    if authorize:
+        expansion['ip4'].extend(target['ip4'])
+        expansion['ip6'].extend(target['ip6'])
+
+
+# Given a term's argument, returns (domain, ip4 prefix, ip6 prefix), e.g. "mx:example.com/24"
+def parseDomainSpec(argument, default_domain):
+    match = SPF_CIDR.match(argument)
+    domain = match.group(1) or default_domain
+    return (domain, match.group(2), match.group(3))
+
+
+# Evaluates SPF records, following every term that costs a DNS lookup. Expansions of include
+# and redirect targets are memoized by name; they are only stored once complete, so threads
+# expanding the same target at the same moment may both do the (cached) work. An expansion
+# that was cut short by a loop depends on the names above it and is never memoized.
+class SpfExpander(object):
+
+    def __init__(self, source, workers=EXPAND_WORKERS):
+        self.cache = ResolutionCache(source)
+        self.workers = workers
+        self.targets = {}
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    # Given a domain, returns its single SPF record, or None with an error added to expansion
+    def lookupSpf(self, domain, expansion):
+        (status, values) = self.cache.query(domain, 'TXT')
+        if status == 'error':
+            expansion['errors'].append('temperror:{}'.format(domain))
+            return None
+
+        if status == 'void':
+            expansion['void-lookups'] += 1
+
+        records = [value for value in values if SPF_VERSION.match(value)]
+        if not records:
+            expansion['errors'].append('no-spf:{}'.format(domain))
+            return None
+
+        if len(records) > 1:
+            expansion['errors'].append('multiple-spf:{}'.format(domain))
+            return None
+
+        return records[0]
+
+    # Given a target of include or redirect, returns its memoized expansion
+    def expandTarget(self, domain, stack):
+        domain = normalizeName(domain)
+
+        if domain in stack:
+            expansion = newExpansion()
+            expansion['errors'].append('loop:{}'.format(domain))
+            return expansion
+
+        with self.lock:
+            if domain in self.targets:
+                self.reused += 1
+                return self.targets[domain]
+
+        expansion = newExpansion()
+        record = self.lookupSpf(domain, expansion)
+        if record is not None:
+            mergeExpansion(expansion, self.expandRecord(domain, record, stack + (domain,)), True)
+
+        if not any(error.startswith('loop:') for error in expansion['errors']):
+            with self.lock:
+                self.targets[domain] = expansion
+        return expansion
+
+    # Resolves the A/AAAA records of a name into networks with the given prefix lengths;
+    # returns False if the name had no addresses
+    def addHost(self, expansion, host, ip4_prefix, ip6_prefix, authorize):
+        found = False
+        for (rdtype, key, prefix, default) in (('A', 'ip4', ip4_prefix, '32'), ('AAAA', 'ip6', ip6_prefix, '128')):
+            (status, values) = self.cache.query(host, rdtype)
+            if status == 'error':
+                expansion['errors'].append('temperror:{}'.format(host))
+            for address in values:
+                found = True
+                if authorize:
+                    expansion[key].append('{}/{}'.format(address, prefix or default))
+        return found
+
+    # Given the domain that published it and the record text, returns the expansion of one
+    # SPF record
+    def expandRecord(self, domain, record, stack=()):
+        domain = normalizeName(domain)
+        record = recordText(record)
+        expansion = newExpansion()
+        redirect = None
+        has_all = False
+
+        for term in record.split()[1:]:
+            qualifier = '+'
+            if term[0] in '+-~?':
+                qualifier = term[0]
+                term = term[1:]
+            authorize = (qualifier == '+')
+
+            if '=' in term.split(':', 1)[0]:
+                (modifier, value) = term.split('=', 1)
+                if modifier.lower() == 'redirect':
+                    redirect = value
+                continue
+
+            (mechanism, separator, argument) = term.partition(':')
+            if not separator and '/' in mechanism:
+                (mechanism, argument) = (mechanism[:mechanism.index('/')], mechanism[mechanism.index('/'):])
+            mechanism = mechanism.lower()
+
+            if mechanism == 'all':
+                has_all = True
+
+            elif mechanism == 'ip4':
+                if authorize:
+                    expansion['ip4'].append(argument)
+
+            elif mechanism == 'ip6':
+                if authorize:
+                    expansion['ip6'].append(argument)
+
+            elif mechanism in ('include', 'a', 'mx', 'ptr', 'exists'):
+                expansion['lookups'] += 1
+                (target, ip4_prefix, ip6_prefix) = parseDomainSpec(argument, domain)
+
+                # Macros depend on the connecting client, so there is nothing to resolve
+                if '%' in target:
+                    expansion['errors'].append('macro:{}'.format(target))
+                    continue
+
+                if mechanism == 'include':
+                    expansion['includes'].append(normalizeName(target))
+                    mergeExpansion(expansion, self.expandTarget(target, stack + (domain,)), authorize)
+
+                elif mechanism == 'a':
+                    if not self.addHost(expansion, target, ip4_prefix, ip6_prefix, authorize):
+                        expansion['void-lookups'] += 1
+
+                elif mechanism == 'mx':
+                    (status, hosts) = self.cache.query(target, 'MX')
+                    if status == 'error':
+                        expansion['errors'].append('temperror:{}'.format(target))
+                    elif not hosts:
+                        expansion['void-lookups'] += 1
+                    elif len(hosts) > SPF_MAX_MX_NAMES:
+                        expansion['errors'].append('mx-limit:{}'.format(target))
+                    for host in hosts[:SPF_MAX_MX_NAMES]:
+                        self.addHost(expansion, host, ip4_prefix, ip6_prefix, authorize)
+
+        # redirect only applies to records without an all term
+        if redirect and not has_all:
+            expansion['lookups'] += 1
+            if '%' in redirect:
+                expansion['errors'].append('macro:{}'.format(redirect))
+            else:
+                mergeExpansion(expansion, self.expandTarget(redirect, stack + (domain,)), True)
+
+        return expansion
+
+    def stats(self):
+        return "{}; {} include targets expanded, reused {} times".format(self.cache.stats(), len(self.targets), self.reused)
+
+    # Given the expansion of a record, returns the limits it breaks
+    def violations(self, expansion):
+        found = []
+        if expansion['lookups'] > SPF_MAX_LOOKUPS:
+            found.append('lookup-limit')
+        if expansion['void-lookups'] > SPF_MAX_VOID_LOOKUPS:
+            found.append('void-lookup-limit')
+        return found
+
+    def worker(self, in_q, out_q):
+        while True:
+            job = in_q.get()
+            if job is None:
+                break
+
+            (index, domain, record) = job
+            try:
+                out_q.put((index, domain, record, self.expandRecord(domain, record)))
+            except Exception as e:
+                expansion = newExpansion()
+                expansion['errors'].append('exception:{}'.format(e))
+                out_q.put((index, domain, record, expansion))
+
+    # Given an iterable of (domain, record), expands the records on a pool of threads and
+    # yields (domain, record, expansion) in input order, holding at most a few batches of
+    # records in memory
+    def run(self, records):
+        in_q = queue.Queue()
+        out_q = queue.Queue()
+        threads = []
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker, args=(in_q, out_q))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        records = iter(records)
+        submitted = 0
+        emitted = 0
+        done = {}
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and submitted - emitted < self.workers * 4:
+                    try:
+                        (domain, record) = next(records)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_q.put((submitted, domain, record))
+                    submitted += 1
+
+                if emitted == submitted:
+                    break
+
+                (index, domain, record, expansion) = out_q.get()
+                done[index] = (domain, record, expansion)
+
+                while emitted in done:
+                    yield done.pop(emitted)
+                    emitted += 1
+
+        finally:
+            for t in threads:
+                in_q.put(None)
+            for t in threads:
+                t.join()
@@ -0,0 +1,188 @@
+# timeseries.py: SQLite store for the per-domain timeseries built by merge-timeseries.py.
+#   Classified snapshots are ingested one sample date at a time, in date order, so adding a
+#   day only reads that day's snapshot. A domain's records of one type are stored once per
+#   run of consecutive samples in which they didn't change, as an interval with first_seen
+#   and last_seen dates, so the store grows with the churn rather than with the number of
+#   samples. Any sample's view is rebuilt from the intervals that cover its date. The class
+#   set of every domain is tracked as it is ingested so the domains whose classes changed on
+#   a date can be listed without scanning the history.
+
+import os
+import re
+import json
+import bisect
+import time
+import sqlite3
+
+from snapshot import *
+
+SAMPLE_DATE = re.compile(r'activedns\-([0-9]+)\-class')
+
+# json.dumps puts ', ' between items when indenting in Python 2 and ',' in Python 3
+ITEM_SEPARATOR = json.dumps([0, 0], indent=4).split('\n')[1][len('    0'):]
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS samples (date TEXT PRIMARY KEY, source TEXT, ingested REAL)",
+    "CREATE TABLE IF NOT EXISTS intervals (domain TEXT, rtype TEXT, first_seen TEXT, last_seen TEXT, count INTEGER, records TEXT, PRIMARY KEY (domain, rtype, first_seen))",
+    "CREATE INDEX IF NOT EXISTS intervals_last_seen ON intervals (last_seen)",
+    "CREATE TABLE IF NOT EXISTS domain_state (domain TEXT PRIMARY KEY, classes TEXT, date TEXT)",
+    "CREATE TABLE IF NOT EXISTS changes (date TEXT, domain TEXT, before TEXT, after TEXT, PRIMARY KEY (date, domain))",
+]
+
+
+# Given the path of a classified result set, returns the sample date in its name
+def sampleDate(path):
+    match = SAMPLE_DATE.search(os.path.basename(os.path.normpath(path)))
+    if match is None:
+        raise ValueError("No sample date in {}".format(path))
+    return match.group(1)
+
+
+# Groups the records of one class of a classified result set by domain; rdata is whitespace
+# normalized the way merged.json always stored it
+def readDomains(path, rclass):
+    domains = {}
+    for (domain, rdata) in readClass(path, rclass):
+        domains.setdefault(domain, []).append(' '.join(rdata.split()))
+    return domains
+
+
+class TimeseriesStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def dates(self):
+        return [row[0] for row in self.db.execute("SELECT date FROM samples ORDER BY date")]
+
+    # Adds one classified result set (JSON, shard directory or snapshot) as the sample for
+    # date. Samples have to arrive in date order; returns False if the date is already in
+    # the store. The sample goes into a temporary table first; intervals ending on the
+    # previous sample with the same records are extended to date and the rest start new
+    # intervals.
+    def ingest(self, path, date=None):
+        date = date if date else sampleDate(path)
+        dates = self.dates()
+
+        if date in dates:
+            return False
+        if dates and date < dates[-1]:
+            raise ValueError("Sample {} is older than the latest ingested sample {}".format(date, dates[-1]))
+        previous = dates[-1] if dates else None
+
+        try:
+            self.db.execute("CREATE TEMP TABLE sample (domain TEXT, rtype TEXT, count INTEGER, records TEXT, PRIMARY KEY (domain, rtype))")
+
+            for rclass in sorted(listClasses(path).keys()):
+                domains = readDomains(path, rclass)
+                self.db.executemany("INSERT INTO sample VALUES (?, ?, ?, ?)",
+                        ((domain, rclass, len(records), json.dumps(records)) for (domain, records) in domains.iteritems()))
+
+            self.db.execute("""UPDATE intervals SET last_seen = ? WHERE last_seen = ? AND EXISTS
+                    (SELECT 1 FROM sample s WHERE s.domain = intervals.domain AND s.rtype = intervals.rtype AND s.records = intervals.records)""",
+                    (date, previous))
+            self.db.execute("""INSERT INTO intervals SELECT domain, rtype, ?, ?, count, records FROM sample s WHERE NOT EXISTS
+                    (SELECT 1 FROM intervals i WHERE i.domain = s.domain AND i.rtype = s.rtype AND i.last_seen = ?)""",
+                    (date, date, date))
+
+            self.updateClasses(date)
+            self.db.execute("INSERT INTO samples VALUES (?, ?, ?)", (date, os.path.abspath(path), time.time()))
+            self.db.execute("DROP TABLE sample")
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            self.db.execute("DROP TABLE IF EXISTS sample")
+            raise
+
+        return True
+
+    # Compares every domain's class set in the sample being ingested with its last known
+    # one, recording the domains that changed (appeared, disappeared or gained or lost a class)
+    def updateClasses(self, date):
+        current = {}
+        for (domain, rtype) in self.db.execute("SELECT domain, rtype FROM sample"):
+            current.setdefault(domain, []).append(rtype)
+
+        changes = []
+        state = []
+        for (domain, before) in self.db.execute("SELECT domain, classes FROM domain_state"):
+            after = ' '.join(sorted(current.pop(domain, [])))
+            if before != after:
+                changes.append((date, domain, before, after))
+                state.append((domain, after, date))
+
+        for (domain, classes) in current.iteritems():
+            after = ' '.join(sorted(classes))
+            changes.append((date, domain, '', after))
+            state.append((domain, after, date))
+
+        self.db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?)", changes)
+        self.db.executemany("INSERT OR REPLACE INTO domain_state VALUES (?, ?, ?)", state)
+
+    # Returns {rtype: {date: {'count': n, 'records': [...]}}} for one domain, the domain's
+    # entry in merged.json, by expanding its intervals over the sample dates they cover
+    def history(self, domain, dates=None):
+        dates = dates if dates else self.dates()
+        history = {}
+        for (rtype, first_seen, last_seen, count, records) in self.db.execute(
+                "SELECT rtype, first_seen, last_seen, count, records FROM intervals WHERE domain = ?", (domain,)):
+            sample = {'count': count, 'records': json.loads(records)}
+            for date in dates[bisect.bisect_left(dates, first_seen):bisect.bisect_right(dates, last_seen)]:
+                history.setdefault(rtype, {})[date] = sample
+        return history
+
+    # Rebuilds the classified result set of one sample date as {rtype: {'count': n,
+    # 'records': ['domain rrdata', ...]}}, ordered by domain
+    def view(self, date):
+        if date not in self.dates():
+            raise ValueError("No sample for {}".format(date))
+
+        data = {}
+        for (domain, rtype, records) in self.db.execute(
+                "SELECT domain, rtype, records FROM intervals WHERE last_seen >= ? AND first_seen <= ? ORDER BY domain, rtype", (date, date)):
+            rclass = data.setdefault(rtype, {'count': 0, 'records': []})
+            for rdata in json.loads(records):
+                rclass['records'].append('{} {}'.format(domain, rdata))
+                rclass['count'] += 1
+        return data
+
+    # Returns (intervals stored, samples they stand for)
+    def stats(self):
+        dates = self.dates()
+        position = dict((date, i) for (i, date) in enumerate(dates))
+        intervals = 0
+        samples = 0
+        for (first_seen, last_seen) in self.db.execute("SELECT first_seen, last_seen FROM intervals"):
+            intervals += 1
+            samples += position[last_seen] - position[first_seen] + 1
+        return (intervals, samples)
+
+    # Returns [(domain, classes before, classes after)] for the domains whose class set
+    # changed on date; class sets are space separated and empty for an absent domain
+    def changed(self, date):
+        return list(self.db.execute("SELECT domain, before, after FROM changes WHERE date = ? ORDER BY domain", (date,)))
+
+    def domains(self):
+        for (domain,) in self.db.execute("SELECT DISTINCT domain FROM intervals ORDER BY domain"):
+            yield domain
+
+    # Writes the whole store as merged.json, one domain at a time; the output is the same as
+    # json.dumps(merged, indent=4, sort_keys=True) of the full nested dict
+    def exportMerged(self, f):
+        dates = self.dates()
+        f.write("{")
+        separator = "\n"
+        for domain in self.domains():
+            value = json.dumps(self.history(domain, dates), indent=4, sort_keys=True).replace("\n", "\n    ")
+            f.write('{}    {}: {}'.format(separator, json.dumps(domain), value))
+            separator = ITEM_SEPARATOR + "\n"
+        f.write("\n}\n" if separator != "\n" else "}\n")